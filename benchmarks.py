@@ -0,0 +1,365 @@
+import argparse
+import heapq
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not on windows, peak memory is reported as nan there
+    resource = None
+
+
+## Benchmark suite: GallerySim over a grid of gallery sizes, microbenchmarks of the event
+## list backends, the splay tree and the choice of painting (at a real run's occupancy), and
+## equivalence checks that the optimized paths give the same seeded results as the reference
+## (selection="scan", fel="heap", the scalar Customer.scorePainting). Throughput and peak memory are compared
+## against a JSON baseline and any regression beyond the tolerance fails the run. Throughput
+## is compared relative to a fixed reference workload (heap operations, small numpy calls,
+## none of the model's code) timed in the same process right before each repeat of a
+## microbenchmark and each chunk of a sim run. The median of those ratios is what is
+## compared, so a baseline made on one machine still holds on a faster or slower (or busy) one.
+##
+##   python benchmarks.py                      quick grid, compare with benchmarks_baseline.json
+##   python benchmarks.py --grid full          num_paintings 10..5000 x num_customers 1e3..1e6 (hours)
+##   python benchmarks.py --update-baseline    store the results as the new baseline
+
+GRIDS = {
+    "quick": {"num_paintings": [10, 100, 1000], "num_customers": [1000]},
+    "medium": {"num_paintings": [10, 100, 1000], "num_customers": [1000, 10000]},
+    "full": {"num_paintings": [10, 100, 1000, 5000], "num_customers": [1000, 10000, 100000, 1000000]},
+}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+SEED = 12345
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return math.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _reference_workload(ops: int = 20000):
+    rng = np.random.default_rng(SEED)
+    keys = rng.random(ops).tolist()
+    small = rng.random(64)
+
+    def run():
+        heap = []
+        total = 0.0
+        for i, key in enumerate(keys):
+            heapq.heappush(heap, (key, i))
+            if len(heap) > 100:
+                total += heapq.heappop(heap)[0]
+            if i % 8 == 0:
+                total += float(np.argmax(small * key))
+        return total
+    return run
+
+
+REFERENCE_OPS = 20000
+# a sim run is timed in chunks of about this many seconds, with the reference timed before each
+SIM_CHUNK_SECONDS = 0.25
+MIN_SIM_CHUNKS = 7
+
+
+def _ops_per_second(function, ops: int):
+    start = time.perf_counter()
+    function()
+    return ops / (time.perf_counter() - start)
+
+
+def _sim_events(sim):
+    # every customer arrives, views paintings (each ending in a MOVE event) and departs
+    return sim.stats.num_arrived + sim.stats.num_paintings_viewed + sim.stats.num_departed
+
+
+def _sim_benchmark(args):
+    num_paintings, num_customers, selection, fel = args
+    import main
+    reference = _reference_workload(REFERENCE_OPS)
+    before = _peak_rss_mb()
+    peak_memory = math.nan
+    ratios, references = [], []
+    total_events, total_seconds, runs = 0, 0.0, 0
+    # short runs are repeated until there are enough chunks for a stable median
+    while runs == 0 or len(ratios) < MIN_SIM_CHUNKS:
+        sim = main.GallerySim(num_paintings, num_customers, SEED, selection=selection, fel=fel)
+        runs += 1
+        chunks = 0
+        done = False
+        while not done:
+            references.append(_ops_per_second(reference, REFERENCE_OPS))
+            events = _sim_events(sim)
+            start = time.perf_counter()
+            while not done and time.perf_counter() - start < SIM_CHUNK_SECONDS:
+                done = sim.step(256) < 256
+            elapsed = time.perf_counter() - start
+            events = _sim_events(sim) - events
+            total_events += events
+            total_seconds += elapsed
+            # the short last chunk of a run only counts when it is the whole run
+            if elapsed >= SIM_CHUNK_SECONDS / 2 or chunks == 0:
+                ratios.append(events / elapsed / references[-1])
+                chunks += 1
+        if runs == 1:
+            peak_memory = _peak_rss_mb() - before
+    return {"seconds": total_seconds / runs, "throughput": total_events / total_seconds, "unit": "events/s",
+            "peak_memory_mb": peak_memory, "reference": float(np.median(references)), "relative": float(np.median(ratios))}
+
+
+def sim_benchmarks(grid, selections=("scan", "index"), fel="heap"):
+    '''name -> result of a GallerySim run for every gallery size of grid. Each run gets a
+    fresh process, so its peak memory isn't hidden by an earlier, bigger run.'''
+    results = {}
+    for num_customers in grid["num_customers"]:
+        for num_paintings in grid["num_paintings"]:
+            for selection in selections:
+                name = "sim/{}/{}/paintings={}/customers={}".format(selection, fel, num_paintings, num_customers)
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    results[name] = pool.submit(_sim_benchmark, (num_paintings, num_customers, selection, fel)).result()
+                _progress(name, results[name])
+    return results
+
+
+def _timed_ops(function, ops: int, repeat: int = 7):
+    '''ops/s of function() (which does ops operations) and, as "relative", the median over
+    repeat runs of its ops/s over the reference workload's, timed right before each run'''
+    reference = _reference_workload(REFERENCE_OPS)
+    ratios, seconds, references = [], [], []
+    for i in range(repeat):
+        references.append(_ops_per_second(reference, REFERENCE_OPS))
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+        ratios.append(ops / seconds[-1] / references[-1])
+    median = float(np.median(seconds))
+    return {"seconds": median, "throughput": ops / median, "unit": "ops/s", "peak_memory_mb": math.nan,
+            "reference": float(np.median(references)), "relative": float(np.median(ratios))}
+
+
+def _hold(backend: str, size: int, ops: int):
+    # the classic hold model: keep size events scheduled, take the next one off and schedule a new one
+    from eventlist import EventList
+    from main import Event, EventType
+    rng = np.random.default_rng(SEED)
+    increments = rng.exponential(1.0, size + ops).tolist()
+
+    def run():
+        fel = EventList(backend)
+        for i in range(size):
+            fel.enqueue(Event(EventType.MOVE, increments[i], i))
+        for i in range(size, size + ops):
+            event = fel.dequeue()
+            fel.enqueue(Event(EventType.MOVE, event.time + increments[i], i))
+    return run
+
+
+def _splay(size: int, ops: int):
+    from splaytree import SplayTree
+    rng = np.random.default_rng(SEED)
+    keys = rng.random(size + ops).tolist()
+
+    def run():
+        tree = SplayTree()
+        for i in range(size):
+            tree.insert((keys[i], i))
+        for i in range(size, size + ops):
+            tree.pop_min()
+            tree.insert((keys[i], i))
+    return run
+
+
+def _selection_state(num_paintings: int, num_customers: int = 30):
+    # a real run half way through: every customer is in the gallery, has viewed about half the
+    # paintings and the paintings have the few viewers a run gives them. Stepped with the index,
+    # which makes the same choices as the scan, only faster.
+    import main
+    sim = main.GallerySim(num_paintings, num_customers, SEED, selection="index")
+    for i in range(num_customers * num_paintings // 2):
+        if sim.nextEventTime() is None:
+            break
+        sim.ProcessNextEvent()
+    customers = sim.customers
+    in_gallery = np.flatnonzero(customers.arrived[:len(customers)] & ~customers.departed[:len(customers)]).tolist()
+    return sim, in_gallery
+
+
+def _scoring(state, ops: int, selection: str):
+    # one move's choice of painting, as ProcessMove makes it with each selection
+    sim, in_gallery = state
+    paintings, customers = sim.paintings, sim.customers
+
+    def scan():
+        for i in range(ops):
+            id = in_gallery[i % len(in_gallery)]
+            painting_scores = paintings.scores(customers.viewed_mask(id), customers.tolerance[id], customers.favorite_style[id])
+            sim.stats.addPaintingScores(painting_scores[painting_scores > 0])
+            np.argmax(painting_scores)
+
+    def index():
+        for i in range(ops):
+            paintings.best(customers, in_gallery[i % len(in_gallery)])
+    return scan if selection == "scan" else index
+
+
+def micro_benchmarks(quick=True):
+    results = {}
+    ops = 20000 if quick else 200000
+    for size in (100, 10000):
+        for backend in ("heap", "calendar", "splay"):
+            name = "micro/eventlist/{}/hold={}".format(backend, size)
+            results[name] = _timed_ops(_hold(backend, size, ops), ops)
+            _progress(name, results[name])
+        name = "micro/splaytree/hold={}".format(size)
+        results[name] = _timed_ops(_splay(size, ops), ops)
+        _progress(name, results[name])
+    for num_paintings in (10, 100, 1000, 5000):
+        state = _selection_state(num_paintings)
+        for selection in ("scan", "index"):
+            name = "micro/scoring/{}/paintings={}".format(selection, num_paintings)
+            calls = max(200, ops // max(1, num_paintings // 100))
+            results[name] = _timed_ops(_scoring(state, calls, selection), calls)
+            _progress(name, results[name])
+    return results
+
+
+def _same(a, b):
+    return all(a[k] == b[k] or (isinstance(a[k], float) and math.isnan(a[k]) and math.isnan(b[k])) for k in a)
+
+
+def check_equivalence(quick=True):
+    '''list of failures: optimized paths whose seeded results differ from the reference'''
+    import main
+    failures = []
+    sizes = [(5, 200), (20, 300), (100, 200)] if quick else [(5, 200), (20, 300), (100, 200), (300, 1000)]
+    # selection="index" doesn't see every painting's score, so those statistics are left out of its comparison
+    scan_only = {"average_painting_score", "max_painting_score", "min_painting_score", "std_painting_score",
+                 "median_painting_score"}
+    for num_paintings, num_customers in sizes:
+        for seed in (1, 2):
+            reference = main.GallerySim(num_paintings, num_customers, seed).run()
+            for selection, fel in [("scan", "calendar"), ("scan", "splay"), ("index", "heap"), ("index", "calendar")]:
+                report = main.GallerySim(num_paintings, num_customers, seed, selection=selection, fel=fel).run()
+                keys = [k for k in reference if selection == "scan" or k not in scan_only]
+                if not _same({k: reference[k] for k in keys}, {k: report[k] for k in keys}) \
+                        or reference.num_customers_leave_early != report.num_customers_leave_early:
+                    failures.append("selection={} fel={} paintings={} customers={} seed={}".format(
+                        selection, fel, num_paintings, num_customers, seed))
+
+    # a traced run rebuilt from its trace, occupancy statistics included, in both selection modes
+    # (the rebuild has no painting score statistics)
+    import tempfile
+    import tracing
+    with tempfile.TemporaryDirectory() as directory:
+        for selection in ("scan", "index"):
+            for num_paintings, num_customers, seed in [(5, 200, 3), (20, 300, 1)]:
+                path = os.path.join(directory, "{}-{}.trace".format(selection, num_paintings))
+                report = main.GallerySim(num_paintings, num_customers, seed, selection=selection, occupancy=True,
+                                         tracer=tracing.TraceWriter(path)).run()
+                stats, customers, paintings = tracing.rebuild_stats(path)
+                rebuilt = stats.report(customers, paintings)
+                keys = [k for k in report if k not in scan_only]
+                if not _same({k: report[k] for k in keys}, {k: rebuilt[k] for k in keys}):
+                    failures.append("trace rebuild differs from the run: selection={} paintings={} customers={} seed={}".format(
+                        selection, num_paintings, num_customers, seed))
+
+    # the array scoring kernel against the scalar reference Customer.scorePainting
+    rng = np.random.default_rng(SEED)
+    for num_paintings in (10, 200):
+        sim = main.GallerySim(num_paintings, 50, SEED)
+        sim.paintings.num_viewers[:] = rng.integers(0, 30, num_paintings)
+        customers = main.CustomerTable(50, num_paintings, config=sim.config)
+        for i in range(50):
+            id = customers.add(int(rng.integers(0, 4)), float(rng.uniform(0.01, 8)))
+            for painting in rng.choice(num_paintings, num_paintings // 3, replace=False).tolist():
+                customers.mark_viewed(id, painting)
+            customer = customers[id]
+            scalar = [customer.scorePainting(p) for p in sim.paintings]
+            kernel = sim.paintings.scores(customers.viewed_mask(id), customer.tolerance, customer.favorite_style)
+            if scalar != kernel.tolist():
+                failures.append("scoring kernel differs from Customer.scorePainting (paintings={}, customer={})".format(num_paintings, id))
+                break
+    return failures
+
+
+def compare(results, baseline, tolerance):
+    '''list of regressions: throughput (relative to the reference workload) below, or peak
+    memory above, the baseline by more than tolerance'''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        # absolute throughputs of an older baseline only hold on the machine that made it, they aren't compared
+        if "relative" in base and result["relative"] < base["relative"] * (1 - tolerance):
+            regressions.append("{}: {:.3f} x reference vs baseline {:.3f} ({:+.0%})".format(
+                name, result["relative"], base["relative"], result["relative"] / base["relative"] - 1))
+        base_memory = base.get("peak_memory_mb", math.nan)
+        # a few MB either way is just the allocator
+        if not math.isnan(result["peak_memory_mb"]) and not math.isnan(base_memory) \
+                and result["peak_memory_mb"] > max(base_memory * (1 + tolerance), base_memory + 5):
+            regressions.append("{}: peak memory {:.1f} MB vs baseline {:.1f} MB".format(
+                name, result["peak_memory_mb"], base_memory))
+    return regressions
+
+
+def _progress(name, result):
+    print("{:<55} {:>14,.0f} {:<8} {:>9.3f} x ref {:>9.1f} MB".format(
+        name, result["throughput"], result["unit"], result["relative"], result["peak_memory_mb"]), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GallerySim benchmark suite")
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="quick")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed relative slowdown / memory growth")
+    parser.add_argument("--skip-sim", action="store_true", help="only the microbenchmarks and equivalence checks")
+    args = parser.parse_args(argv)
+    quick = args.grid == "quick"
+
+    failures = check_equivalence(quick)
+    for failure in failures:
+        print("NOT EQUIVALENT: " + failure)
+    print("equivalence checks: {}".format("FAILED" if failures else "ok"), flush=True)
+
+    results = micro_benchmarks(quick)
+    if not args.skip_sim:
+        results.update(sim_benchmarks(GRIDS[args.grid]))
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print("baseline written to {}".format(args.baseline))
+        return 1 if failures else 0
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+    else:
+        print("no baseline at {}, run with --update-baseline to make one".format(args.baseline))
+    for regression in regressions:
+        print("REGRESSION: " + regression)
+    if failures or regressions:
+        print("FAILED: {} equivalence failures, {} regressions".format(len(failures), len(regressions)))
+        return 1
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import math
+
+import numpy as np
+
+from confidence import mean_confidence_interval
+from replications import map_tasks, run_cached, spawn_seeds
+
+
+## Comparing two scenarios of the gallery with paired replications.
+## With common random numbers (crn) replication i of both scenarios runs from the same seed,
+## and every customer keeps their own viewing-time stream, so the two runs see the same
+## arrivals, tolerances, styles, paintings and viewing times and the noise in the difference
+## mostly cancels. With antithetic pairs each replication is the average of a run and its
+## antithetic run. Either way the pairs are independent, so the difference gets a t interval.
+##
+## compare_after_warmup runs the part both scenarios have in common only once per pair:
+## a sim is warmed up and then forked (GallerySim.fork) into the two scenarios.
+##
+## A scenario is a main.SimConfig, or a dict of the SimConfig fields that differ from the
+## defaults, e.g. {"min_score": 120} or {"viewing_time_mean": 4, "patience_constant": 2}.
+
+def scenario_config(scenario):
+    '''the SimConfig of a scenario'''
+    import main
+    if isinstance(scenario, main.SimConfig):
+        return scenario
+    return main.SimConfig().replace(**(scenario or {}))
+
+
+def _average(report, mirror):
+    # a replication of an antithetic pair is the average of the run and its antithetic run
+    return {metric: (report[metric] + mirror[metric]) / 2 for metric in report}
+
+
+class ComparisonResults:
+    '''Paired replications of scenarios a and b, with a confidence interval for the mean
+    difference b - a of every metric.'''
+
+    def __init__(self, results_a, results_b, confidence=0.95):
+        self.results_a = results_a
+        self.results_b = results_b
+        self.confidence = confidence
+        self.metrics = list(results_a[0].keys()) if results_a else []
+
+        # metric -> {"mean_a", "mean_b", "difference", "half_width", "low", "high", "variance_ratio"}
+        self.differences = {}
+        for metric in self.metrics:
+            a, b = self.values(metric)
+            difference, half_width = mean_confidence_interval(b - a, confidence)
+            self.differences[metric] = {
+                "mean_a": float(np.nanmean(a)) if not np.all(np.isnan(a)) else math.nan,
+                "mean_b": float(np.nanmean(b)) if not np.all(np.isnan(b)) else math.nan,
+                "difference": difference,
+                "half_width": half_width,
+                "low": difference - half_width,
+                "high": difference + half_width,
+                # variance of the paired difference over the variance it would have with independent runs
+                "variance_ratio": _variance_ratio(a, b),
+            }
+
+    def values(self, metric):
+        '''(scenario a values, scenario b values) of metric, one per pair'''
+        return (np.array([r[metric] for r in self.results_a], dtype=float),
+                np.array([r[metric] for r in self.results_b], dtype=float))
+
+    def difference(self, metric):
+        return self.differences[metric]["difference"]
+
+    def confidence_interval(self, metric):
+        return self.differences[metric]["low"], self.differences[metric]["high"]
+
+    def __str__(self):
+        lines = ["{} pairs, {:.0f}% confidence intervals for b - a:".format(len(self.results_a), self.confidence * 100)]
+        lines.append("{:<40} {:>12} {:>12} {:>24} {:>10}".format("", "a", "b", "b - a", "var ratio"))
+        for metric in self.metrics:
+            d = self.differences[metric]
+            lines.append("{:<40} {:>12.4f} {:>12.4f} {:>12.4f} +/- {:<8.4f} {:>10.3f}".format(
+                metric, d["mean_a"], d["mean_b"], d["difference"], d["half_width"], d["variance_ratio"]))
+        return "\n".join(lines)
+
+
+def _variance_ratio(a, b):
+    keep = ~(np.isnan(a) | np.isnan(b))
+    a, b = a[keep], b[keep]
+    if len(a) < 2:
+        return math.nan
+    independent = np.var(a, ddof=1) + np.var(b, ddof=1)
+    if independent == 0:
+        return math.nan
+    return float(np.var(b - a, ddof=1) / independent)
+
+
+def compare_scenarios(num_paintings: int, num_customers: int, scenario_a, scenario_b, num_pairs: int = 10,
+                      seed=None, workers=None, crn=True, antithetic=False, confidence=0.95, cache=None):
+    '''Run num_pairs replications of both scenarios (SimConfigs or dicts of SimConfig fields) over
+    `workers` processes and compare them. With crn both runs of pair i use the same seed,
+    otherwise every run gets its own. Runs already in cache (a ResultCache or its path) aren't run again.'''
+    if crn:
+        seeds_a = seeds_b = spawn_seeds(seed, num_pairs)
+    else:
+        seeds = spawn_seeds(seed, 2 * num_pairs)
+        seeds_a, seeds_b = seeds[:num_pairs], seeds[num_pairs:]
+    scenario_a, scenario_b = scenario_config(scenario_a), scenario_config(scenario_b)
+    tasks = [(num_paintings, num_customers, s, {"crn": crn, "config": scenario_a}) for s in seeds_a]
+    tasks += [(num_paintings, num_customers, s, {"crn": crn, "config": scenario_b}) for s in seeds_b]
+    if antithetic:
+        tasks += [(p, c, s, dict(kwargs, antithetic=True)) for p, c, s, kwargs in tasks]
+    results = run_cached(tasks, workers, cache if seed is not None else None)
+    if antithetic:
+        results = [_average(report, mirror) for report, mirror in zip(results[:2 * num_pairs], results[2 * num_pairs:])]
+    else:
+        results = [dict(report) for report in results]
+    return ComparisonResults(results[:num_pairs], results[num_pairs:], confidence)
+
+
+def _forked_pair(task):
+    num_paintings, num_customers, seed, warmup_time, base, config_a, config_b, sim_kwargs = task
+    import main
+    sim = main.GallerySim(num_paintings, num_customers, seed, config=base, **sim_kwargs)
+    sim.run_until(warmup_time)
+    return dict(sim.fork(config_a).run()), dict(sim.fork(config_b).run())
+
+
+def compare_after_warmup(num_paintings: int, num_customers: int, warmup_time: float, scenario_a, scenario_b,
+                         num_pairs: int = 10, seed=None, workers=None, base=None, crn=True, confidence=0.95,
+                         **sim_kwargs):
+    '''Like compare_scenarios, but each pair is one sim run to warmup_time under the base
+    scenario (scenario_a by default) and then forked into scenarios a and b, so the warm-up is
+    only simulated once per pair. The paintings are hung before the fork, so the scenarios
+    can't change quality_mean or quality_std. The reports cover the whole run, warm-up included.'''
+    scenario_a, scenario_b = scenario_config(scenario_a), scenario_config(scenario_b)
+    base = scenario_config(base) if base is not None else scenario_a
+    tasks = [(num_paintings, num_customers, s, warmup_time, base, scenario_a, scenario_b, dict(sim_kwargs, crn=crn))
+             for s in spawn_seeds(seed, num_pairs)]
+    pairs = map_tasks(_forked_pair, tasks, workers)
+    return ComparisonResults([a for a, b in pairs], [b for a, b in pairs], confidence)
@@ -0,0 +1,98 @@
+import math
+import numpy as np
+
+
+## Confidence intervals for the output analysis (replications, paired comparisons, ...).
+## Only needs numpy: the Student t quantile is found by bisection on its CDF, which
+## is written in terms of the regularized incomplete beta function.
+
+def _betacf(a, b, x):
+    # continued fraction for the incomplete beta function (modified Lentz, Numerical Recipes 6.4)
+    TINY = 1e-300
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = 1.0
+    d = 1 - qab * x / qap
+    if abs(d) < TINY:
+        d = TINY
+    d = 1 / d
+    h = d
+    for m in range(1, 300):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 + aa * d
+        if abs(d) < TINY:
+            d = TINY
+        c = 1 + aa / c
+        if abs(c) < TINY:
+            c = TINY
+        d = 1 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 + aa * d
+        if abs(d) < TINY:
+            d = TINY
+        c = 1 + aa / c
+        if abs(c) < TINY:
+            c = TINY
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    '''regularized incomplete beta function I_x(a, b)'''
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1 - front * _betacf(b, a, 1 - x) / b
+
+
+def t_cdf(t, df):
+    tail = 0.5 * betainc(df / 2, 0.5, df / (df + t * t))
+    return 1 - tail if t > 0 else tail
+
+
+def t_quantile(p, df):
+    '''inverse of the Student t CDF with df degrees of freedom'''
+    if df <= 0:
+        return math.nan
+    if p == 0.5:
+        return 0.0
+    if p < 0.5:
+        return -t_quantile(1 - p, df)
+    lo, hi = 0.0, 1.0
+    while t_cdf(hi, df) < p:
+        hi *= 2
+    for i in range(200):
+        mid = (lo + hi) / 2
+        if t_cdf(mid, df) < p:
+            lo = mid
+        else:
+            hi = mid
+        if hi - lo < 1e-12 * max(1.0, hi):
+            break
+    return (lo + hi) / 2
+
+
+def mean_confidence_interval(values, confidence=0.95):
+    '''(mean, half width) of a t confidence interval for the mean of independent values.
+    nan values (statistics a replication had no data for) are left out.'''
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n == 0:
+        return math.nan, math.nan
+    mean = float(np.mean(values))
+    if n == 1:
+        return mean, math.nan
+    half_width = t_quantile(1 - (1 - confidence) / 2, n - 1) * float(np.std(values, ddof=1)) / math.sqrt(n)
+    return mean, half_width
@@ -0,0 +1,187 @@
+import heapq
+from bisect import insort
+
+import splaytree as SplayTree
+
+
+### FUTURE EVENT LIST BACKENDS ###
+## Every backend stores (time, seq, event) entries. seq is a counter handed out by
+## EventList, so two events at the same time never compare equal (nothing gets
+## dropped) and they come back out in the order they were scheduled.
+## A backend needs push(time, seq, event), pop() -> event, peek() -> event or None,
+## peek_key() -> (time, seq) of that event or None and __len__.
+
+class HeapBackend:
+    '''binary heap (heapq), O(log n) push and pop'''
+
+    def __init__(self):
+        self.heap = []
+
+    def push(self, time, seq, event):
+        heapq.heappush(self.heap, (time, seq, event))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[2]
+
+    def peek(self):
+        return self.heap[0][2] if self.heap else None
+
+    def peek_key(self):
+        return self.heap[0][:2] if self.heap else None
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class SplayBackend:
+    '''the original splay tree, keyed on (time, seq, event) tuples so comparisons never reach Event'''
+
+    def __init__(self):
+        self.splaytree = SplayTree.SplayTree()
+
+    def push(self, time, seq, event):
+        self.splaytree.insert((time, seq, event))
+
+    def pop(self):
+        return self.splaytree.pop_min()[2]
+
+    def peek(self):
+        min_key = self.splaytree.findMin()
+        return min_key[2] if min_key is not None else None
+
+    def peek_key(self):
+        min_key = self.splaytree.findMin()
+        return min_key[:2] if min_key is not None else None
+
+    def __len__(self):
+        return len(self.splaytree)
+
+
+class CalendarQueue:
+    '''Brown's calendar queue: events hashed into a ring of "day" buckets of fixed width
+    by time, each bucket a short sorted list. Push and pop are O(1) on average as long
+    as the bucket width matches the spacing of events, so the number of buckets and
+    their width are re-estimated whenever the queue doubles or halves in size.'''
+
+    MIN_BUCKETS = 2
+
+    def __init__(self, num_buckets: int = MIN_BUCKETS, width: float = 1.0):
+        self.size = 0
+        self.last_time = 0.0
+        self._setup(num_buckets, width)
+
+    def _setup(self, num_buckets, width):
+        self.num_buckets = num_buckets
+        self.width = width
+        self.buckets = [[] for i in range(num_buckets)]
+        # day number (time // width, not wrapped around the ring) the search is currently at
+        self.day = int(self.last_time / width)
+
+    def push(self, time, seq, event):
+        day = int(time / self.width)
+        insort(self.buckets[day % self.num_buckets], (time, seq, event))
+        self.size += 1
+        # a peek may have moved the search past this event's day already
+        if day < self.day:
+            self.day = day
+        if self.size > 2 * self.num_buckets:
+            self._resize(2 * self.num_buckets)
+
+    def _find(self):
+        '''bucket holding the earliest event, or None when empty'''
+        if self.size == 0:
+            return None
+        # walk the calendar one day at a time for at most a year...
+        for i in range(self.num_buckets):
+            bucket = self.buckets[self.day % self.num_buckets]
+            if bucket and int(bucket[0][0] / self.width) <= self.day:
+                return bucket
+            self.day += 1
+        # ...nothing this year, so jump straight to the earliest event
+        bucket = min((b for b in self.buckets if b), key=lambda b: b[0][:2])
+        self.day = int(bucket[0][0] / self.width)
+        return bucket
+
+    def pop(self):
+        bucket = self._find()
+        if bucket is None:
+            raise IndexError("pop from empty calendar queue")
+        time, seq, event = bucket.pop(0)
+        self.last_time = time
+        self.size -= 1
+        if self.size < self.num_buckets // 2 and self.num_buckets > self.MIN_BUCKETS:
+            self._resize(self.num_buckets // 2)
+        return event
+
+    def peek(self):
+        bucket = self._find()
+        return bucket[0][2] if bucket is not None else None
+
+    def peek_key(self):
+        bucket = self._find()
+        return bucket[0][:2] if bucket is not None else None
+
+    def __len__(self):
+        return self.size
+
+    def _resize(self, num_buckets):
+        entries = sorted(entry for bucket in self.buckets for entry in bucket)
+        self._setup(num_buckets, self._estimate_width(entries))
+        for entry in entries:
+            self.buckets[int(entry[0] / self.width) % self.num_buckets].append(entry)
+
+    def _estimate_width(self, entries):
+        # bucket width of about 3x the average gap between the next few events (Brown 1988)
+        times = [entry[0] for entry in entries[:25]]
+        gaps = [b - a for a, b in zip(times, times[1:]) if b > a]
+        if not gaps:
+            return self.width
+        return 3 * sum(gaps) / len(gaps)
+
+
+BACKENDS = {
+    "heap": HeapBackend,
+    "calendar": CalendarQueue,
+    "splay": SplayBackend,
+}
+
+
+### EVENT LIST CODE ###
+class EventList:
+    '''Future event list. backend is one of BACKENDS ("heap", "calendar", "splay")
+    or a class with the same push/pop/peek/peek_key/__len__ interface.'''
+
+    def __init__(self, backend="heap"):
+        if isinstance(backend, str):
+            if backend not in BACKENDS:
+                raise ValueError("unknown event list backend '{}', expected one of {}".format(backend, list(BACKENDS)))
+            backend = BACKENDS[backend]
+        self.backend = backend()
+        self.seq = 0
+
+    def enqueue(self, n):
+        self.backend.push(n.time, self.seq, n)
+        self.seq += 1
+
+    def reserve(self):
+        '''the seq an event enqueued now would get, for an event kept outside the list that
+        still has to be ordered against the ones in it (compare (time, seq) with getMinKey())'''
+        seq = self.seq
+        self.seq += 1
+        return seq
+
+    def getMin(self):
+        return self.backend.peek()
+
+    def getMinKey(self):
+        '''(time, seq) of the next event, or None'''
+        return self.backend.peek_key()
+
+    def dequeue(self):
+        return self.backend.pop()
+
+    def isEmpty(self):
+        return len(self.backend) == 0
+
+    def __len__(self):
+        return len(self.backend)
@@ -0,0 +1,133 @@
+import json
+import os
+
+import numpy as np
+
+
+## Columnar export of a run's per-customer and per-painting records.
+## A table is a directory with one raw binary file per column (<name>.bin, native byte order)
+## and a schema.json with the column dtypes and the number of rows, so a column can be
+## memory-mapped or loaded with np.fromfile without reading the rest of the table.
+## Customer records are written as customers depart, a chunk at a time, so the writer
+## only ever holds chunk_size rows however long the run is.
+
+CUSTOMER_COLUMNS = [
+    ("id", np.int64),
+    ("arrival_time", np.float64),
+    ("departure_time", np.float64),
+    ("num_paintings_viewed", np.int32),
+    ("total_viewing_time", np.float64),
+    ("average_score", np.float64),
+    ("left_early", np.bool_),
+    ("saw_favorite_style", np.bool_),
+    ("favorite_style", np.int8),
+    ("tolerance", np.float64),
+]
+
+PAINTING_COLUMNS = [
+    ("id", np.int64),
+    ("style", np.int8),
+    ("quality", np.float64),
+    ("quality_score", np.float64),
+    ("views", np.int64),
+]
+
+
+class ColumnWriter:
+    '''Appends rows to a columnar table in directory, chunk_size rows at a time.'''
+
+    def __init__(self, directory: str, columns, chunk_size: int = 1 << 16):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in columns]
+        self.chunk_size = chunk_size
+        self.buffers = {name: np.empty(chunk_size, dtype) for name, dtype in self.columns}
+        self.filled = 0
+        self.rows = 0
+        self.files = {name: open(os.path.join(directory, name + ".bin"), "wb") for name, dtype in self.columns}
+
+    def append(self, **values):
+        '''add one row, every column must be given'''
+        i = self.filled
+        for name, value in values.items():
+            self.buffers[name][i] = value
+        self.filled += 1
+        if self.filled == self.chunk_size:
+            self.flush()
+
+    def write(self, **columns):
+        '''add many rows at once from arrays of equal length'''
+        self.flush()
+        n = None
+        for name, dtype in self.columns:
+            values = np.ascontiguousarray(columns[name], dtype=dtype)
+            n = len(values)
+            values.tofile(self.files[name])
+        self.rows += n or 0
+
+    def flush(self):
+        if self.filled:
+            for name, dtype in self.columns:
+                self.buffers[name][:self.filled].tofile(self.files[name])
+            self.rows += self.filled
+            self.filled = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        with open(os.path.join(self.directory, "schema.json"), "w") as f:
+            json.dump({"rows": self.rows, "columns": [[name, dtype.str] for name, dtype in self.columns]}, f, indent=1)
+
+
+def read_table(directory: str, mmap: bool = True):
+    '''{column name: array} of a table written by ColumnWriter, memory-mapped unless mmap=False'''
+    with open(os.path.join(directory, "schema.json")) as f:
+        schema = json.load(f)
+    table = {}
+    for name, dtype in schema["columns"]:
+        path = os.path.join(directory, name + ".bin")
+        if mmap and schema["rows"] > 0:
+            table[name] = np.memmap(path, dtype=np.dtype(dtype), mode="r", shape=(schema["rows"],))
+        else:
+            table[name] = np.fromfile(path, dtype=np.dtype(dtype), count=schema["rows"])
+    return table
+
+
+class ResultWriter:
+    '''Writes the records of a GallerySim run under path: path/customers (one row per
+    departed customer, in order of departure) and path/paintings (one row per painting,
+    written when the run finishes). Pass it to GallerySim(writer=...).'''
+
+    def __init__(self, path: str, chunk_size: int = 1 << 16):
+        self.path = path
+        self.customers = ColumnWriter(os.path.join(path, "customers"), CUSTOMER_COLUMNS, chunk_size)
+        self.closed = False
+
+    def add_customer(self, customers, id: int):
+        '''record customer id of a CustomerTable, called when they depart'''
+        num_viewed = int(customers.num_paintings_viewed[id])
+        self.customers.append(
+            id=customers.number[id],
+            arrival_time=customers.arrival_time[id],
+            departure_time=customers.departure_time[id],
+            num_paintings_viewed=num_viewed,
+            total_viewing_time=customers.total_viewing_time[id],
+            average_score=customers.score_total[id] / num_viewed if num_viewed > 0 else np.nan,
+            # customers only leave without being early once they've seen every painting
+            left_early=num_viewed < customers.num_paintings,
+            saw_favorite_style=customers.saw_favorite_style[id],
+            favorite_style=customers.favorite_style[id],
+            tolerance=customers.tolerance[id],
+        )
+
+    def write_paintings(self, paintings, views):
+        writer = ColumnWriter(os.path.join(self.path, "paintings"), PAINTING_COLUMNS)
+        writer.write(id=np.arange(len(paintings)), style=paintings.style, quality=paintings.quality,
+                     quality_score=paintings.quality_score, views=views)
+        writer.close()
+
+    def close(self):
+        if not self.closed:
+            self.customers.close()
+            self.closed = True
@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+
+
+## Spatial gallery layout. Paintings have positions (by default hung around the walls of a
+## grid of rooms) and a customer only considers the paintings within walking radius of
+## where they are standing (of the entrance when they arrive), then walks to the one they
+## pick at walking_speed. The neighbours of every painting are worked out once, as a CSR
+## index (neighbor_start / neighbors / distances), with a grid of radius sized cells so
+## building it doesn't compare every pair of paintings. A move then costs O(neighbourhood)
+## instead of O(paintings).
+
+class GalleryLayout:
+    '''positions: (num_paintings, 2) array of painting positions (metres), radius: how far
+    a customer looks for their next painting, walking_speed: metres per unit of sim time,
+    entrance: where customers come in. If nothing hangs within radius of the entrance the
+    min_entrance_candidates nearest paintings are the first choice instead.'''
+
+    def __init__(self, positions, radius: float = 15.0, walking_speed: float = 1.0, entrance=(0.0, 0.0),
+                 min_entrance_candidates: int = 10):
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.radius = float(radius)
+        self.walking_speed = float(walking_speed)
+        self.entrance = np.asarray(entrance, dtype=float)
+        self.min_entrance_candidates = int(min_entrance_candidates)
+        self.neighbor_start, self.neighbors, self.distances = self._build_index()
+
+        distance = np.hypot(*(self.positions - self.entrance).T)
+        near = np.flatnonzero(distance <= self.radius)
+        if len(near) == 0:
+            near = np.argsort(distance, kind="stable")[:min_entrance_candidates]
+        near = np.sort(near)
+        self.entrance_neighbors = near
+        self.entrance_distances = distance[near]
+
+    @classmethod
+    def rooms(cls, num_paintings: int, paintings_per_room: int = 20, room_size: float = 10.0, **kwargs):
+        '''paintings spaced evenly around the walls of square rooms of side room_size, the rooms
+        in a square grid with the entrance at the corner of the first room'''
+        num_rooms = math.ceil(num_paintings / paintings_per_room)
+        rooms_per_row = math.ceil(math.sqrt(num_rooms))
+        ids = np.arange(num_paintings)
+        room = ids // paintings_per_room
+        # walk around the walls: fraction along the perimeter -> point on the square
+        along = (ids % paintings_per_room + 0.5) / paintings_per_room * 4
+        side = np.floor(along).astype(int)
+        offset = (along - side) * room_size
+        x = np.choose(side, [offset, np.full(num_paintings, room_size), room_size - offset, np.zeros(num_paintings)])
+        y = np.choose(side, [np.zeros(num_paintings), offset, np.full(num_paintings, room_size), room_size - offset])
+        positions = np.column_stack([x + (room % rooms_per_row) * room_size, y + (room // rooms_per_row) * room_size])
+        return cls(positions, **kwargs)
+
+    def _build_index(self):
+        n = len(self.positions)
+        cells = np.floor(self.positions / self.radius).astype(np.int64)
+        # paintings sorted by cell, so each cell's paintings are one slice
+        order = np.lexsort((cells[:, 1], cells[:, 0]))
+        sorted_cells = cells[order]
+        keys, first = np.unique(sorted_cells, axis=0, return_index=True)
+        last = np.append(first[1:], n)
+        cell_slices = {(int(cx), int(cy)): order[a:b] for (cx, cy), a, b in zip(keys, first, last)}
+
+        neighbors = [None] * n
+        distances = [None] * n
+        for (cx, cy), members in cell_slices.items():
+            nearby = [cell_slices[(cx + dx, cy + dy)] for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                      if (cx + dx, cy + dy) in cell_slices]
+            nearby = np.sort(np.concatenate(nearby))
+            # (members, nearby) distance matrix, one cell's worth at a time
+            d = np.hypot(*(self.positions[members][:, None, :] - self.positions[nearby][None, :, :]).transpose(2, 0, 1))
+            for row, id in enumerate(members.tolist()):
+                keep = (d[row] <= self.radius) & (nearby != id)
+                neighbors[id] = nearby[keep]
+                distances[id] = d[row][keep]
+
+        counts = np.array([len(x) for x in neighbors], dtype=np.int64)
+        start = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=start[1:])
+        flat_neighbors = np.concatenate(neighbors) if n else np.zeros(0, dtype=np.int64)
+        flat_distances = np.concatenate(distances) if n else np.zeros(0)
+        return start, flat_neighbors.astype(np.int64), flat_distances
+
+    def __len__(self):
+        return len(self.positions)
+
+    def as_dict(self):
+        '''everything that decides where customers walk, what ResultCache keys a layout run by'''
+        return {"positions": self.positions.tolist(), "radius": self.radius, "walking_speed": self.walking_speed,
+                "entrance": self.entrance.tolist(), "min_entrance_candidates": self.min_entrance_candidates}
+
+    def candidates(self, painting: int):
+        '''(painting ids, distances) a customer at painting (-1: at the entrance) can walk to'''
+        if painting < 0:
+            return self.entrance_neighbors, self.entrance_distances
+        a, b = self.neighbor_start[painting], self.neighbor_start[painting + 1]
+        return self.neighbors[a:b], self.distances[a:b]
+
+    def mean_neighborhood(self):
+        return float(np.mean(np.diff(self.neighbor_start))) if len(self) else 0.0
@@ -1,7 +1,14 @@
 import numpy as np
-import splaytree as SplayTree
+import scoring
+from eventlist import EventList
+from streamstats import RunningStats, QuantileSketch, BatchBuffer, OccupancyStats
+from selection import BestPaintingIndex
+from variates import VariateSupply
+import tracing
 import math
-from enum import Enum
+import pickle
+from dataclasses import dataclass, asdict, fields
+from enum import Enum, IntEnum
 import matplotlib.pyplot as plt
 
 
@@ -29,11 +36,46 @@ STYLE_CONSTANT = 1
 PATIENCE_CONSTANT = 1
 QUALITY_CONSTANT = 1
 
+## the occupancy statistics count the time each painting has more than this many viewers
+OCCUPANCY_THRESHOLDS = (1, 4)
+
 
 DEBUG=False
 
+
+@dataclass(frozen=True)
+class SimConfig:
+    '''The model parameters of one run. The defaults are the module constants above,
+    pass a SimConfig to GallerySim to vary them per run (e.g. SimConfig(min_score=120)).'''
+    tolerance_mean: float = TOLERANCE_MEAN
+    tolerance_std: float = TOLERANCE_STD
+    quality_mean: float = QUALITY_MEAN
+    quality_std: float = QUALITY_STD
+    interarrival_time_mean: float = INTERARRIVAL_TIME_MEAN
+    viewing_time_mean: float = VIEWING_TIME_MEAN
+    viewing_time_std: float = VIEWING_TIME_STD
+    min_score: float = MIN_SCORE
+    style_constant: float = STYLE_CONSTANT
+    patience_constant: float = PATIENCE_CONSTANT
+    quality_constant: float = QUALITY_CONSTANT
+
+    @classmethod
+    def field_names(cls):
+        return [f.name for f in fields(cls)]
+
+    def replace(self, **changes):
+        '''copy with some fields changed, unknown names are an error'''
+        unknown = set(changes) - set(self.field_names())
+        if unknown:
+            raise ValueError("unknown SimConfig fields: {}".format(", ".join(sorted(unknown))))
+        return SimConfig(**{**asdict(self), **changes})
+
+    def as_dict(self):
+        return asdict(self)
+
 # enum of event types
-class EventType(Enum):
+# an IntEnum so an event's type can index GallerySim's dispatch table directly
+class EventType(IntEnum):
     ARRIVAL = 0
     DEPARTURE = 1
     MOVE = 2
@@ -71,75 +113,267 @@ class Style(Enum):
     def random(rng):
         return rng.integers(0, 4)
 
+class PaintingTable:
+    '''All the gallery's paintings stored as arrays indexed by painting id
+    (quality, style, num_viewers and the precomputed quality part of the score),
+    so a customer can score the whole gallery in one numpy expression.'''
+
+    def __init__(self, style, quality, config: SimConfig = None):
+        self.config = config if config is not None else SimConfig()
+        self.style = np.asarray(style, dtype=np.int64)
+        self.quality = np.asarray(quality, dtype=float)
+
+        self.num_viewers = np.zeros(len(self.quality), dtype=np.int64)
+
+        # the quality score never changes so only work it out once per painting
+        self.quality_score = np.array([scoring.quality_score(q, self.config.quality_constant) for q in self.quality])
+
+        self.index: BestPaintingIndex = None
+        # time-weighted viewer statistics, kept up to date by set_num_viewers when set
+        self.occupancy: OccupancyStats = None
+
+    def set_config(self, config: SimConfig):
+        '''score with config from now on (rebuild the index after a change of quality_constant)'''
+        if config.quality_constant != self.config.quality_constant:
+            self.quality_score = np.array([scoring.quality_score(q, config.quality_constant) for q in self.quality])
+        self.config = config
+
+    def build_index(self):
+        '''keep a BestPaintingIndex in sync with num_viewers so best() doesn't have to score every painting'''
+        self.index = BestPaintingIndex(self.quality_score, self.style, self.num_viewers)
+
+    def set_num_viewers(self, id: int, value: int, time: float):
+        '''the one place num_viewers changes, so the index and occupancy statistics can follow it'''
+        if self.index is not None:
+            self.index.update(id, int(self.num_viewers[id]), int(value))
+        if self.occupancy is not None:
+            self.occupancy.change(id, int(self.num_viewers[id]), int(value), time)
+        self.num_viewers[id] = value
+
+    def __len__(self):
+        return len(self.quality)
+
+    def __getitem__(self, id: int):
+        return Painting(self, id)
+
+    def __iter__(self):
+        return (Painting(self, i) for i in range(len(self)))
+
+    def scores(self, viewed, tolerance, favorite_style, candidates=None):
+        '''scores of every painting for a customer (-1 for the ones in the viewed mask), or only
+        of the paintings in the candidates id array (viewed is then a mask of the candidates)'''
+        if candidates is None:
+            return scoring.score_paintings(self.quality_score, self.num_viewers, self.style, viewed,
+                                           tolerance, favorite_style, self.config.patience_constant, self.config.style_constant)
+        return scoring.score_paintings(self.quality_score[candidates], self.num_viewers[candidates], self.style[candidates],
+                                       viewed, tolerance, favorite_style, self.config.patience_constant, self.config.style_constant)
+
+    def best(self, customers, id: int):
+        '''(painting id, score) of customer id's best unviewed painting, same choice as np.argmax of their scores'''
+        if self.index is None:
+            painting_scores = self.scores(customers.viewed_mask(id), customers.tolerance[id], customers.favorite_style[id])
+            best_id = np.argmax(painting_scores)
+            return best_id, painting_scores[best_id]
+        return self.index.best(id, customers.tolerance[id], customers.favorite_style[id],
+                               self.config.patience_constant, self.config.style_constant)
+
 class Painting:
-    def __init__(self, id: int, style: Style, rng):
+    '''View of a single painting in a PaintingTable'''
+    def __init__(self, table: PaintingTable, id: int):
+        self.table = table
         self.id = id
-        self.style = style
-        self.num_viewers = 0
-        self.quality: float = np.clip(rng.normal(QUALITY_MEAN, QUALITY_STD), 0, 0.9999)
-
-class Customer:
 
-    CurrentID = 0
-
-    def __init__(self, num_paintings: int, rng):
-        self.id: int = Customer.CurrentID
-        Customer.CurrentID += 1
+    @property
+    def style(self):
+        return self.table.style[self.id]
+
+    @property
+    def quality(self) -> float:
+        return self.table.quality[self.id]
+
+    # read only, a change of viewers needs the time for the occupancy statistics (PaintingTable.set_num_viewers)
+    @property
+    def num_viewers(self):
+        return self.table.num_viewers[self.id]
+
+class Column:
+    '''attribute of a row view (Customer, CustomerStats) that reads and writes one column of its table'''
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, row, owner=None):
+        if row is None:
+            return self
+        return getattr(row.table, self.name)[row.id]
+
+    def __set__(self, row, value):
+        getattr(row.table, self.name)[row.id] = value
+
+class CustomerTable:
+    '''Customers stored as arrays indexed by customer id (a row of the table), pre-sized for
+    num_customers. Which paintings a customer has viewed is a packed bitmap, one bit per
+    painting. Events refer to customers by their id.
+    With num_customers=None the table starts small and doubles whenever it fills up.
+    retire(id) hands the row of a departed customer back for the next arrival, so a table
+    whose customers are retired only needs as many rows as there are customers in the gallery
+    at once. number[id] is the customer's arrival number (0, 1, 2, ...), which is also their
+    id as long as nothing is retired.'''
+
+    # column -> value of a row without a customer
+    COLUMNS = {"number": -1, "favorite_style": 0, "tolerance": 0, "current_painting": -1, "viewed": 0, "arrival_time": 0,
+               "departure_time": 0, "arrived": False, "departed": False, "saw_favorite_style": False,
+               "num_paintings_viewed": 0, "total_viewing_time": 0, "score_total": 0, "score_min": np.inf,
+               "score_max": -np.inf}
+    INITIAL_SIZE = 1024
+
+    def __init__(self, num_customers: int, num_paintings: int, keep_history=False, config: SimConfig = None):
+        self.config = config if config is not None else SimConfig()
+        self.num_paintings = num_paintings
+        self.count = 0  # rows used so far
+        self.num_added = 0  # customers added so far
+        self.free = []  # rows of retired customers, reused by add()
+        self.growable = num_customers is None
+        if self.growable:
+            num_customers = self.INITIAL_SIZE
+
+        self.number = np.full(num_customers, -1, dtype=np.int64)
+        self.favorite_style = np.zeros(num_customers, dtype=np.int8)
+        # positive number, higher the tolerance the less affectec the customer is by the number of viewers
+        self.tolerance = np.zeros(num_customers)
+        self.current_painting = np.full(num_customers, -1, dtype=np.int32)
+        self.viewed = np.zeros((num_customers, (num_paintings + 7) // 8), dtype=np.uint8)
+
+        self.arrival_time = np.zeros(num_customers)
+        self.departure_time = np.zeros(num_customers)
+        self.arrived = np.zeros(num_customers, dtype=bool)
+        self.departed = np.zeros(num_customers, dtype=bool)
+        self.saw_favorite_style = np.zeros(num_customers, dtype=bool)
+        self.num_paintings_viewed = np.zeros(num_customers, dtype=np.int32)
+        self.total_viewing_time = np.zeros(num_customers)
+        # total/min/max of the scores of the paintings each customer viewed (count is num_paintings_viewed)
+        self.score_total = np.zeros(num_customers)
+        self.score_min = np.full(num_customers, np.inf)
+        self.score_max = np.full(num_customers, -np.inf)
+
+        # customer id -> [(Painting, score), ...], only kept when asked for
+        self.score_history = {} if keep_history else None
+
+    def add(self, favorite_style: int, tolerance: float) -> int:
+        '''add the next customer and return their id'''
+        if self.free:
+            id = self.free.pop()
+        else:
+            id = self.count
+            if id >= len(self.tolerance):
+                if not self.growable:
+                    raise IndexError("CustomerTable is full ({} customers)".format(len(self.tolerance)))
+                self._grow(2 * len(self.tolerance))
+            self.count += 1
+        self.number[id] = self.num_added
+        self.num_added += 1
+        self.favorite_style[id] = favorite_style
+        self.tolerance[id] = tolerance
+        if self.score_history is not None:
+            self.score_history[id] = []
+        return id
+
+    def _grow(self, size: int):
+        for name, fill in self.COLUMNS.items():
+            old = getattr(self, name)
+            new = np.full((size,) + old.shape[1:], fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def retire(self, id: int):
+        '''forget departed customer id and free their row for the next customer'''
+        for name, fill in self.COLUMNS.items():
+            getattr(self, name)[id] = fill
+        if self.score_history is not None:
+            del self.score_history[id]
+        self.free.append(id)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, id: int):
+        return Customer(self, id)
+
+    def __iter__(self):
+        # the customers still in the table, retired rows are skipped
+        return (Customer(self, i) for i in range(self.count) if self.number[i] >= 0)
+
+    def viewed_mask(self, id: int):
+        '''bool array, True for every painting customer id has viewed'''
+        return np.unpackbits(self.viewed[id], count=self.num_paintings).view(bool)
+
+    def viewed_of(self, id: int, paintings):
+        '''bool array, True for each painting of the paintings id array customer id has viewed'''
+        return (self.viewed[id][paintings >> 3] & (0x80 >> (paintings & 7)).astype(np.uint8)) != 0
+
+    def has_viewed(self, id: int, painting: int):
+        return bool(self.viewed[id, painting >> 3] & (0x80 >> (painting & 7)))
+
+    def mark_viewed(self, id: int, painting: int):
+        self.viewed[id, painting >> 3] |= 0x80 >> (painting & 7)
+
+    def add_score(self, id: int, painting, score):
+        self.score_total[id] += score
+        if score < self.score_min[id]:
+            self.score_min[id] = score
+        if score > self.score_max[id]:
+            self.score_max[id] = score
+        if self.score_history is not None:
+            self.score_history[id].append((painting, score)) #adding as tuple so we can keep track of both
 
-        self.rng = rng
-        self.favorite_style: Style = Style.random(rng)
+class Customer:
+    '''View of a single customer in a CustomerTable. The scoring methods are the scalar
+    reference for the array kernel in scoring.py.'''
 
-        # positive number, higher the tolerance the less affectec the customer is by the number of viewers
-        self.tolerance: float = np.clip(rng.normal(TOLERANCE_MEAN, TOLERANCE_STD), 0.000001, 100)
+    favorite_style = Column("favorite_style")
+    tolerance = Column("tolerance")
 
-        self.viewedPaintings = np.full(num_paintings, False)
+    def __init__(self, table: CustomerTable, id: int):
+        self.table = table
+        self.id = id
 
-        self.current_painting: Painting = None
+    @property
+    def viewedPaintings(self):
+        return self.table.viewed_mask(self.id)
 
+    @property
+    def current_painting(self):
+        return self.table.current_painting[self.id]
 
-        self.stats = CustomerStats()
+    @property
+    def stats(self):
+        return CustomerStats(self.table, self.id)
 
     #get the customer's favorite style
     def favoriteStyle(self):
         return self.favorite_style
-       
-
-    def beginViewing(self, painting: Painting, time: float):
-        painting.num_viewers += 1
-        self.viewing_time: float = np.clip(self.rng.normal(VIEWING_TIME_MEAN, VIEWING_TIME_STD), 0.000001, 100)
-        # if(DEBUG): #(sarah)
-        #     print(self.id,' started viewing', painting.id, 'now there are %d viewers'%painting.num_viewers)
-        return self.viewing_time
 
     def calcViewerScore(self, num_viewers):
-        retval = 1/(max(math.sqrt(num_viewers) * 1/self.tolerance, 1)) * PATIENCE_CONSTANT * 100
+        retval = 1/(max(math.sqrt(num_viewers) * 1/self.tolerance, 1)) * self.table.config.patience_constant * 100
         if(DEBUG):
             print("Viewer score: " + str(retval))
         return retval
     
     def calcQualityScore(self, quality):
-        # Higher this is the lower the slope in the middle
-        SLOPE_CONSTANT = 10
-        ## SHouldn't edit this, the midpoint of the inverse sigmoid is 0.5 at MIDPOINT_HEIGHT of 1. Instead adjust the QUALITY_CONSTANT
-        ## Like you can edit this but you shouldn't need to unless you're doing fancy stuff
-        MIDPOINT_HEIGHT = 1
-
-        ## For quality we want to have low quality paintings be very undesirable and high quality very desirable but 25-75 should have less of an effect
-        ## We can do this by using an inverse sigmoid function
-        retval =  np.clip((0.5 - math.log((1-quality)/(quality * MIDPOINT_HEIGHT))/SLOPE_CONSTANT) * QUALITY_CONSTANT * 100, 0, 100)
+        # inverse sigmoid, see scoring.quality_score
+        retval = scoring.quality_score(quality, self.table.config.quality_constant)
         if(DEBUG):
             print("Quality score: " + str(retval))
         return retval
     
     def calcStyleScore(self, style):
 
-        retval= 1 * STYLE_CONSTANT if style == self.favorite_style else 0
+        retval= 1 * self.table.config.style_constant if style == self.favorite_style else 0
         if(DEBUG):
             print("Style score: " + str(retval))
         return retval
 
     def scorePainting(self, painting: Painting) -> float:
-        if self.viewedPaintings[painting.id]:
+        if self.table.has_viewed(self.id, painting.id):
             return -1
         
 
@@ -156,7 +390,14 @@ class Customer:
 
     
 class Event:
-    def __init__(self, type: EventType, time: float, customer: Customer):
+    '''A scheduled event. GallerySim gives every customer one Event for their whole visit:
+    their arrival event becomes each of their moves in turn and goes back to the sim's pool
+    when they depart, for the next arrival. The event list orders events by (time, seq)
+    itself, the comparisons here are only for comparing events by hand.'''
+
+    __slots__ = ("time", "customer", "type")
+
+    def __init__(self, type: EventType, time: float, customer: int):
         self.time = time
         self.customer = customer
         self.type = type
@@ -165,63 +406,148 @@ class Event:
         return self.time
 
     def __lt__(self, other):
-        return self.time < other.get_time()
+        return self.time < other.time
 
     def __eq__(self, other):
-        return self.time == other.get_time()
+        return self.time == other.time
 
     def __ne__(self, other):
-        return not self.__eq__(other)
+        return self.time != other.time
 
     def __gt__(self, other):
-        return not self.__lt__(other) and not self.__eq__(other)
+        return self.time > other.time
 
     def __le__(self, other):
-        return self.__lt__(other) or self.__eq__(other)
+        return self.time <= other.time
 
     def __ge__(self, other):
-        return self.__gt__(other) or self.__eq__(other)
+        return self.time >= other.time
+
+class CustomerStats:
+    '''View of one customer's statistics in a CustomerTable'''
+
+    arrival_time = Column("arrival_time")
+    departure_time = Column("departure_time")
+    departed = Column("departed")
+    arrived = Column("arrived")
+    num_paintings_viewed = Column("num_paintings_viewed")
+    total_viewing_time = Column("total_viewing_time")
+    saw_favorite_style = Column("saw_favorite_style")
+
+    def __init__(self, table: CustomerTable, id: int):
+        self.table = table
+        self.id = id
 
-### EVENT LIST CODE ###
-class EventList:
+    @property
+    def average_score(self):
+        n = self.num_paintings_viewed
+        return self.table.score_total[self.id] / n if n > 0 else np.nan
 
-    def __init__(self):
-        self.splaytree = SplayTree.SplayTree() 
+    @property
+    def score_history(self):
+        return self.table.score_history[self.id] if self.table.score_history is not None else None
 
-    def enqueue(self, n):
-        self.splaytree.insert(n)
 
-    def getMin(self):
-        return self.splaytree.findMin()
-    
-    def dequeue(self):
-        #sarah: splaytree.remove() doesn't return the key it removes, so we have to do it ourselves
-        min_key = self.splaytree.findMin()
-        self.splaytree.remove(min_key)
-        return min_key
+class SimReport(dict):
+    '''Results of a run: a dict of statistic name -> value (nan where a statistic had
+    no data), plus the per-painting lists. str() gives the printStats report.'''
 
-class CustomerStats:
-    def __init__(self):
-        self.arrival_time = 0.0
-        self.departure_time = 0.0 
-        self.departed = False
-        self.arrived = False
-        self.num_paintings_viewed = 0
-        self.total_viewing_time = 0.0
-        self.score_history = []
-        self.saw_favorite_style = False
+    def __init__(self, metrics):
+        super().__init__(metrics)
+        self.painting_qualities = []
+        self.num_customers_leave_early = []
+        # time average and peak number of viewers of each painting, and threshold -> percent of
+        # the time each painting had more viewers than that (empty without occupancy statistics)
+        self.painting_occupancy = []
+        self.painting_peak_occupancy = []
+        self.painting_time_over = {}
+
+    def __str__(self):
+        lines = []
+        ###### Performance Stats ######
+
+
+        ###### General Stats ######
+        lines.append("General Stats:")
+
+        lines.append("Number of Customers Arrived: {}".format(self["num_arrived"]))
+        lines.append("Number of Customers Departed: {}".format(self["num_departed"]))
+
+
+        ###### Painting Stats ######
+        lines.append("")
+        lines.append("Statistics for Each Painting:")
+        lines.append("Number of Paintings: {}".format(self["num_paintings"]))
+        lines.append("Average Number of Views for Each Painting: {:.2f}".format(self["average_views_per_painting"]))
+        lines.append("Quality of Each Painting: {}".format(self.painting_qualities))
+        ## When printing the average quality round the number to 2 decimal places
+
+        lines.append("Average quality of paintings: {:.2f}".format(self["average_painting_quality"]))
+        lines.append("Maximum quality of paintings: {:.2f}".format(self["max_painting_quality"]))
+        lines.append("Minimum quality of paintings: {:.2f}".format(self["min_painting_quality"]))
+        if "average_painting_occupancy" in self:
+            lines.append("Average Number of Viewers at each painting over time: {:.2f}".format(self["average_painting_occupancy"]))
+            lines.append("Most Viewers at a painting at once: {}".format(self["max_painting_occupancy"]))
+            for threshold in self.painting_time_over:
+                lines.append("Percentage of time paintings had more than {} viewers: {:.2f}%".format(
+                    threshold, self["percent_time_over_{}_viewers".format(threshold)]))
+
+        ###### Customer Stats ######
+        lines.append("")
+        lines.append("Statistics for Each Customer:")
+        lines.append("Number of Customers: {}".format(self["num_customers"]))
+        lines.append("Average Percentage of Paintings Viewed per Customer: {:.2f}%".format(self["percent_paintings_viewed"]))
+        lines.append("Average Viewing Time for each painting: {:.2f}".format(self["average_viewing_time"]))
+        if "average_walking_time" in self:
+            lines.append("Average Walking Time to each painting: {:.2f}".format(self["average_walking_time"]))
+        if not np.isnan(self["average_painting_score"]):
+            lines.append("Average Painting Score: {:.2f}".format(self["average_painting_score"]))
+            lines.append("Maximum Painting Score: {:.2f}".format(self["max_painting_score"]))
+            lines.append("Minimum Painting Score: {:.2f}".format(self["min_painting_score"]))
+        else:
+            lines.append("Average Painting Score: n/a")
+            lines.append("Maximum Painting Score: n/a")
+            lines.append("Minimum Painting Score: n/a")
+
+
+        ###### Favorite Style Stats ######
+        lines.append("")
+        lines.append("Statistics for Customers who saw their favorite style:")
+
+        lines.append("Number of Customers who saw their favorite style: {}".format(self["percent_saw_favorite_style"]))
+        lines.append("Average Attractiveness when customer views their favourite style: {:.2f}".format(self["average_attractiveness_for_favourite"]))
+
+
+        ###### LEAVE EARLY STATS ######
+        lines.append("")
+        lines.append("Statistics for Customers who leave for Each Painting: {}".format(self.num_customers_leave_early))
+        lines.append("Average Score for painting that made Customers leave Early: {:.2f}".format(self["average_leave_early_score"]))
+        lines.append("Average number of paintings left when customer leaves early: {:.2f}%".format(self["percent_paintings_left_leave_early"]))
+        lines.append("Percentage of Customers who leave early: {}%".format(self["percent_leave_early"]))
+        return "\n".join(lines)
 
 
 class SimStats:
-    def __init__(self, num_customers, num_paintings):
+    def __init__(self, num_customers, num_paintings, keep_raw=False):
+        '''Score statistics are kept as streaming accumulators (RunningStats for mean/variance/
+        min/max, QuantileSketch for quantiles) so memory doesn't grow with the run.
+        keep_raw=True also keeps every raw score in painting_scores / leave_early_scores
+        and each customer's score_history, like before.'''
         self.num_customers = num_customers
         self.num_paintings = num_paintings
+        self.keep_raw = keep_raw
 
         self.total_viewing_time = 0.0
+        self.total_walking_time = None  # only kept with a spatial layout
+        self.occupancy = None  # OccupancyStats of the paintings' viewers, GallerySim(occupancy=True) sets it
         self.num_arrived = 0
         self.num_departed = 0
         self.num_paintings_viewed = 0
         self.num_leave_early = 0
+        self.num_saw_favorite_style = 0  # of the customers that have departed
+        self.painting_score_stats = RunningStats()
+        self.painting_score_quantiles = QuantileSketch()
+        self.painting_score_buffer = BatchBuffer(self.painting_score_stats, self.painting_score_quantiles)
         self.painting_scores = []
 
         #keep track of number of people with favorite style paintings 
@@ -235,87 +561,93 @@ class SimStats:
         
         self.num_painting_views = [0 for i in range(num_paintings)]
 
+        self.leave_early_score_stats = RunningStats()
+        self.leave_early_score_quantiles = QuantileSketch()
         self.leave_early_scores = []
         self.num_painting_left_leave_early = 0
 
+    def addPaintingScores(self, scores):
+        '''record the (positive) scores a customer gave the paintings on a move'''
+        self.painting_score_buffer.add_many(scores)
+        if self.keep_raw:
+            self.painting_scores.extend(scores.tolist())
 
+    def addLeaveEarlyScore(self, score):
+        self.leave_early_score_stats.add(score)
+        self.leave_early_score_quantiles.add(score)
+        if self.keep_raw:
+            self.leave_early_scores.append(score)
 
 
 
-    def printStats(self, customers, paintings):
-        average_viewing_time = self.total_viewing_time / self.num_paintings_viewed
 
-        average_paintings_viewed = (((self.num_paintings_viewed / len(paintings))/len(customers)) * 100)
 
-        # percentage of people who saw their favorite style
+    def report(self, customers, paintings):
+        '''SimReport of every statistic printStats reports. Only the customers that have
+        departed are counted, from the totals kept as they left (departed customers may have
+        been retired from customers already).'''
+        num_departed = self.num_departed
         # count number of customers who saw their favorite style
-        saw_favorite_style = 0
-        for customer in customers:
-            if customer.stats.saw_favorite_style:
-                saw_favorite_style += 1
-
-        percent_saw_favorite_style = ((saw_favorite_style / self.num_customers) * 100)
-
-        # average attractiveness for favourite is the average attractiveness for all customers who saw their favourite style
-        avgerage_attractiveness_for_favourite = ((self.attractiveness_for_favourite / saw_favorite_style))
-
-        # average painting score is the average for all painting scores for all customers
-        average_painting_score = np.average(np.array(self.painting_scores))
+        saw_favorite_style = self.num_saw_favorite_style
 
         # make list of painting qualities in one line. From the 'paintings' array
         painting_qualities = [i.quality for i in paintings]
 
+        # average painting score is the average for all painting scores for all customers
+        # (not collected when the sim picks paintings with the index instead of scoring them all)
+        self.painting_score_buffer.flush()
+        painting_scores = self.painting_score_stats
 
-        ###### Performance Stats ######
-
-
-        ###### General Stats ######
-        print("General Stats:")
-
-        print("Number of Customers Arrived: {}".format(self.num_arrived))
-        print("Number of Customers Departed: {}".format(self.num_departed))
-
-
-        ###### Painting Stats ######
-        print()
-        print("Statistics for Each Painting:")
-        print("Number of Paintings: {}".format(self.num_paintings))
-        print("Average Number of Views for Each Painting: {:.2f}".format(np.average(np.array(self.num_painting_views))))
-        print("Quality of Each Painting: {}".format(painting_qualities))
-        ## When printing the average quality round the number to 2 decimal places
-
-        print("Average quality of paintings: {:.2f}".format(np.average(np.array(painting_qualities))))
-        print("Maximum quality of paintings: {:.2f}".format(np.max(np.array(painting_qualities))))
-        print("Minimum quality of paintings: {:.2f}".format(np.min(np.array(painting_qualities))))
-
-        ###### Customer Stats ######
-        print()
-        print("Statistics for Each Customer:")
-        print("Number of Customers: {}".format(self.num_customers))
-        print("Average Percentage of Paintings Viewed per Customer: {:.2f}%".format(average_paintings_viewed))
-        print("Average Viewing Time for each painting: {:.2f}".format(average_viewing_time))
-        print("Average Painting Score: {:.2f}".format(np.average(np.array(self.painting_scores))))
-        print("Maximum Painting Score: {:.2f}".format(np.max(np.array(self.painting_scores))))
-        print("Minimum Painting Score: {:.2f}".format(np.min(np.array(self.painting_scores))))
-
-
-        ###### Favorite Style Stats ######
-        print()
-        print("Statistics for Customers who saw their favorite style:")
-
-        print("Number of Customers who saw their favorite style: {}".format(percent_saw_favorite_style))
-        print("Average Attractiveness when customer views their favourite style: {:.2f}".format(avgerage_attractiveness_for_favourite))
-
-
-        ###### LEAVE EARLY STATS ######
         avg_num_paintings_left = self.num_painting_left_leave_early/self.num_leave_early if self.num_leave_early > 0 else 0
+        # a run to a time horizon has no set number of customers, its percentages are of the ones that left
+        num_customers = self.num_customers if self.num_customers is not None else max(self.num_departed, 1)
+
+        report = SimReport({
+            "num_arrived": self.num_arrived,
+            "num_departed": self.num_departed,
+            "num_paintings": self.num_paintings,
+            "average_views_per_painting": np.average(np.array(self.num_painting_views)),
+            "average_painting_quality": np.average(np.array(painting_qualities)),
+            "max_painting_quality": np.max(np.array(painting_qualities)),
+            "min_painting_quality": np.min(np.array(painting_qualities)),
+            # the customers that arrived, for a run to a time horizon
+            "num_customers": self.num_customers if self.num_customers is not None else self.num_arrived,
+            "percent_paintings_viewed": (((self.num_paintings_viewed / len(paintings))/num_departed) * 100) if num_departed > 0 else np.nan,
+            "average_viewing_time": self.total_viewing_time / self.num_paintings_viewed if self.num_paintings_viewed > 0 else np.nan,
+            "average_painting_score": painting_scores.mean,
+            "max_painting_score": painting_scores.max if len(painting_scores) > 0 else np.nan,
+            "min_painting_score": painting_scores.min if len(painting_scores) > 0 else np.nan,
+            "std_painting_score": painting_scores.std if len(painting_scores) > 1 else np.nan,
+            "median_painting_score": self.painting_score_quantiles.quantile(0.5),
+            # percentage of people who saw their favorite style
+            "percent_saw_favorite_style": ((saw_favorite_style / num_customers) * 100),
+            # average attractiveness for favourite is the average attractiveness for all customers who saw their favourite style
+            "average_attractiveness_for_favourite": (self.attractiveness_for_favourite / saw_favorite_style) if saw_favorite_style > 0 else np.nan,
+            "average_leave_early_score": self.leave_early_score_stats.mean,
+            "median_leave_early_score": self.leave_early_score_quantiles.quantile(0.5),
+            "percent_paintings_left_leave_early": avg_num_paintings_left/len(paintings) * 100,
+            "percent_leave_early": self.num_leave_early/num_customers * 100,
+        })
+        if self.total_walking_time is not None:
+            report["average_walking_time"] = self.total_walking_time / self.num_paintings_viewed if self.num_paintings_viewed > 0 else np.nan
+        if self.occupancy is not None:
+            occupancy = self.occupancy.mean()
+            report["average_painting_occupancy"] = float(np.mean(occupancy)) if len(occupancy) else np.nan
+            report["max_painting_occupancy"] = int(np.max(self.occupancy.peaks())) if len(occupancy) else 0
+            report.painting_occupancy = occupancy.tolist()
+            report.painting_peak_occupancy = self.occupancy.peaks().tolist()
+            for threshold in self.occupancy.thresholds:
+                time_over = self.occupancy.fraction_above(threshold) * 100
+                report["percent_time_over_{}_viewers".format(threshold)] = float(np.mean(time_over)) if len(time_over) else np.nan
+                report.painting_time_over[threshold] = time_over.tolist()
+        report.painting_qualities = painting_qualities
+        report.num_customers_leave_early = list(self.num_customers_leave_early)
+        return report
 
-        print()
-        print("Statistics for Customers who leave for Each Painting: {}".format(self.num_customers_leave_early))
-        print("Average Score for painting that made Customers leave Early: {:.2f}".format(np.average(np.array(self.leave_early_scores))))
-        print("Average number of paintings left when customer leaves early: {:.2f}%".format(avg_num_paintings_left/len(paintings) * 100))
-        print("Percentage of Customers who leave early: {}%".format(self.num_leave_early/self.num_customers * 100))
-
+    def printStats(self, customers, paintings):
+        report = self.report(customers, paintings)
+        print(report)
+        return report
 
 
 
@@ -344,89 +676,412 @@ class SimStats:
 
 
 
+## Random variates. Every purpose draws from its own stream in blocks (see variates.py),
+## these draw a block of n values with the distribution parameters from the SimConfig.
+## With antithetic=True they return the values the mirrored uniforms (1 - U) would have
+## given, for antithetic pairs.
+def drawNormals(rng, n, mean, std, antithetic=False):
+    values = rng.normal(mean, std, n)
+    if antithetic:
+        values = 2 * mean - values
+    return values
+
+def drawInterArrivalTimes(rng, n, mean=INTERARRIVAL_TIME_MEAN, antithetic=False):
+    #sarah: rng.exponential takes parameters scale: float, and size: (int or tuple of ints).
+    #   doesn't take a parameter for std dev because it is calculated from the rate (ie. std=mean)
+    values = rng.exponential(mean, n)
+    if antithetic:
+        # x = -mean*log(U) so U = exp(-x/mean), and -mean*log(1-U) is the antithetic value
+        values = -mean * np.log(-np.expm1(-values / mean))
+    return np.clip(values, 0.00001, 100)
+
+def drawViewingTimes(rng, n, mean=VIEWING_TIME_MEAN, std=VIEWING_TIME_STD, antithetic=False):
+    return np.clip(drawNormals(rng, n, mean, std, antithetic), 0.000001, 100)
+
+def drawTolerances(rng, n, mean=TOLERANCE_MEAN, std=TOLERANCE_STD, antithetic=False):
+    return np.clip(drawNormals(rng, n, mean, std, antithetic), 0.000001, 100)
+
+def drawStyles(rng, n, antithetic=False):
+    styles = rng.integers(0, 4, n)
+    return 3 - styles if antithetic else styles
+
+def drawQualities(rng, n, mean=QUALITY_MEAN, std=QUALITY_STD, antithetic=False):
+    return np.clip(drawNormals(rng, n, mean, std, antithetic), 0, 0.9999)
+
+
+class ArrivalStream:
+    '''The arrivals of a run, worked out ahead of the event loop a block at a time: the
+    arrival times (a running sum of the interarrival times, from time 0), favourite styles and
+    tolerances as arrays, handed out one arrival at a time by next(). Arrivals don't depend
+    on what happens in the gallery, so GallerySim keeps them out of the FEL.
+    limit: how many arrivals there are in all (None for no end).'''
+
+    def __init__(self, interarrival_times, favorite_styles, tolerances, limit=None, block_size: int = 4096):
+        self.interarrival_times = interarrival_times
+        self.favorite_styles = favorite_styles
+        self.tolerances = tolerances
+        self.limit = limit
+        self.block_size = block_size
+        self.count = 0  # arrivals handed out
+        self.time = 0.0  # of the last one
+        self.block = []  # [(time, favorite style, tolerance), ...]
+        self.pos = 0
+
+    def _refill(self):
+        n = self.block_size if self.limit is None else min(self.block_size, self.limit - self.count)
+        gaps = self.interarrival_times.take(n)
+        # the same sequence of additions as adding each interarrival time to the last arrival time
+        gaps[0] += self.time
+        times = np.cumsum(gaps)
+        self.block = list(zip(times.tolist(), self.favorite_styles.take(n).tolist(), self.tolerances.take(n).tolist()))
+        self.pos = 0
+
+    def next(self):
+        '''(time, favorite style, tolerance) of the next arrival, or None once there are no more'''
+        if self.limit is not None and self.count >= self.limit:
+            return None
+        if self.pos >= len(self.block):
+            self._refill()
+        arrival = self.block[self.pos]
+        self.pos += 1
+        self.count += 1
+        self.time = arrival[0]
+        return arrival
+
+    def redraw(self):
+        '''drop the arrivals worked out but not handed out yet, the next ones are drawn from the
+        streams again (after the streams have been changed)'''
+        self.block = []
+        self.pos = 0
+
+
 class GallerySim:
-    def __init__(self, num_paintings: int, num_customers: int, seed: int, DEBUG=False): 
+    def __init__(self, num_paintings: int, num_customers: int, seed, DEBUG=False, selection="scan", fel="heap", keep_raw=False,
+                 crn=False, antithetic=False, config: SimConfig = None, writer=None, tracer=None,
+                 profile=False, layout=None, occupancy=False, occupancy_thresholds=OCCUPANCY_THRESHOLDS,
+                 snapshot_interval: float = None, snapshot_capacity: int = 1024):
+        '''seed: an int or a np.random.SeedSequence, every random purpose gets its own substream of it.
+        selection: "scan" scores every painting on each move (and feeds every score to the
+        painting score statistics), "index" uses a BestPaintingIndex which makes the exact same
+        choices in roughly logarithmic time but does not see the scores of the other paintings.
+        Its upkeep only pays off in large galleries, up to about 1000 paintings the scan is faster.
+        fel: future event list backend, "heap", "calendar" or "splay" (see eventlist.BACKENDS).
+        keep_raw: keep every raw score (stats.painting_scores etc., see SimStats) and every
+        customer's row of sim.customers, off by default. Without it a departed customer's row
+        is retired (see CustomerTable.retire), so memory follows how many customers are in
+        the gallery at once rather than how many have arrived.
+        crn: common random numbers, every customer draws their viewing times from their own
+        substream so scenarios run from the same seed see the same customers with the same
+        viewing times even when they make different choices (see comparison.py).
+        antithetic: use the antithetic of every random variate (the other half of an antithetic pair).
+        config: the model parameters (SimConfig), the module constants if not given.
+        writer: an export.ResultWriter to write each customer's record to as they depart,
+        and the paintings' records to when the run finishes.
+        tracer: a tracing.TraceWriter (or anything with its start/record/close methods) that
+        gets a record of every arrival, view and departure. DEBUG=True prints them instead.
+        profile: time the event loop's phases and count events (see profiling.SimProfiler),
+        print(sim.profiler) after the run for the profile. Off by default, when off the
+        sim runs the exact same code as without it.
+        layout: a layout.GalleryLayout of the paintings. Customers then only consider the
+        paintings within its radius of where they stand and walk to the one they pick
+        before viewing it (they count as one of its viewers from when they set off).
+        Without a layout every painting is in reach and walking takes no time.
+        occupancy: keep occupancy statistics, the report then gives the time average and peak
+        number of viewers of every painting and the percentage of the time they had more than
+        each of occupancy_thresholds viewers (see streamstats.OccupancyStats, sim.stats.occupancy).
+        Off by default, every change of viewers pays for them. snapshot_interval (turns them on):
+        also copy every painting's number of viewers every snapshot_interval units of time into a
+        ring buffer of the snapshot_capacity latest copies, sim.stats.occupancy.snapshots() for
+        plotting. A traced run can also rebuild them afterwards (tracing.rebuild_stats).
+
+        This only sets up the model and schedules the first arrival, call run() (or step() /
+        run_until()) to simulate and report() / print(sim.report()) for the results.
+        num_customers=None keeps customers arriving for as long as the sim runs, for a run to
+        a time horizon with run_until() (see steadystate.py), run() then has no end.
+        checkpoint() / GallerySim.restore() save and resume a run, fork() branches it.'''
         self.DEBUG=DEBUG
-        self.CustomersLeft = num_customers
+        if selection not in ("scan", "index"):
+            raise ValueError("selection must be 'scan' or 'index'")
+        self.selection = selection
 
         self.num_paintings = num_paintings
         self.num_customers = num_customers
         self.seed = seed
-
-        self.rng = np.random.default_rng(seed=self.seed)
-
-        self.paintings = [Painting(i, Style.random(self.rng), self.rng) for i in range(num_paintings)]
-
-        self.stats = SimStats(self.num_customers, self.num_paintings)
+        self.config = config = config if config is not None else SimConfig()
+
+        # one stream per purpose, so e.g. arrivals don't shift when the number of viewing times drawn changes
+        self.variates = VariateSupply(self.seed, antithetic=antithetic)
+        # customer id -> that customer's viewing time stream, while they are in the gallery (crn only)
+        self.customer_viewing_times = {} if crn else None
+        self.interarrival_times = self.variates.stream("interarrival", drawInterArrivalTimes, (config.interarrival_time_mean,))
+        self.viewing_time_args = (config.viewing_time_mean, config.viewing_time_std)
+        self.viewing_times = self.variates.stream("viewing_time", drawViewingTimes, self.viewing_time_args)
+        self.tolerances = self.variates.stream("tolerance", drawTolerances, (config.tolerance_mean, config.tolerance_std))
+        self.favorite_styles = self.variates.stream("favorite_style", drawStyles)
+        self.arrivals = ArrivalStream(self.interarrival_times, self.favorite_styles, self.tolerances, num_customers)
+
+        self.paintings = PaintingTable(self.variates.stream("painting_style", drawStyles).take(num_paintings),
+                                       self.variates.stream("painting_quality", drawQualities,
+                                                            (config.quality_mean, config.quality_std)).take(num_paintings),
+                                       config)
+        self.layout = layout
+        if layout is not None:
+            if len(layout) != num_paintings:
+                raise ValueError("layout has {} paintings, the sim {}".format(len(layout), num_paintings))
+            if self.selection != "scan":
+                raise ValueError("a layout already limits the choice to nearby paintings, use selection='scan'")
+        if self.selection == "index":
+            self.paintings.build_index()
+
+        self.keep_raw = keep_raw
+        self.stats = SimStats(self.num_customers, self.num_paintings, keep_raw)
+        if layout is not None:
+            self.stats.total_walking_time = 0.0
+        self.occupancy_thresholds = tuple(occupancy_thresholds)
+        if occupancy or snapshot_interval is not None:
+            self.stats.occupancy = self.paintings.occupancy = OccupancyStats(
+                self.paintings.num_viewers, occupancy_thresholds, snapshot_interval, snapshot_capacity)
 
         self.time = 0.0
-        self.FutureEventList = EventList()
-
-        self.customer = []
+        self.FutureEventList = EventList(fel)
+        # the arrival due next, kept out of the FEL (which only holds MOVE events) with the seq it
+        # would have had there, so it is taken in the same order as if it had been enqueued
+        self.next_arrival = None
+        self.next_arrival_seq = 0
+        # Events of departed customers, reused for new arrivals
+        self.event_pool = []
+        self.dispatch = self.dispatchTable()
+
+        # retired customers' rows are reused, so without keep_raw the table only grows to the peak occupancy
+        self.retire_customers = not keep_raw
+        self.customers = CustomerTable(num_customers if keep_raw else None, num_paintings, keep_raw, config)
+        self.writer = writer
+        if tracer is None and DEBUG:
+            tracer = tracing.PrintTracer()
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.start(self)
+
+        self.profiler = None
+        if profile:
+            from profiling import SimProfiler
+            self.profiler = SimProfiler()
+            self.profiler.install(self)
 
 
         # Schedule the first arrival
         self.ScheduleArrival()
 
+    @property
+    def done(self):
+        return self.num_customers is not None and self.stats.num_departed >= self.num_customers
+
+    def step(self, n_events: int = 1):
+        '''process the next n_events events (fewer if the run finishes first), returns how many were processed'''
+        processed = 0
+        while processed < n_events and not self.done:
+            self.ProcessNextEvent()
+            processed += 1
+        return processed
+
+    def run_until(self, time: float):
+        '''process every event up to and including the given time, returns how many were processed'''
+        processed = 0
+        while not self.done:
+            next_time = self.nextEventTime()
+            if next_time is None or next_time > time:
+                # nothing else happens before then, so the clock can move straight there
+                self.time = max(self.time, time)
+                break
+            self.ProcessNextEvent()
+            processed += 1
+        return processed
+
+    def run(self):
+        '''run until num_customers customers have departed and return the SimReport'''
+        if self.num_customers is None:
+            raise ValueError("a sim without a number of customers never finishes, use run_until()")
         #THIS is our main loop (processes all events)
-        while(self.stats.num_departed < self.num_customers):
-            # get next event
-            next_event = self.FutureEventList.dequeue()
-            self.time = next_event.time
-
-            if(self.DEBUG):
-                print("Event Type: " + next_event.type.__str__() + " Time: " + str(self.time) + " Customer: " + str(next_event.customer.id))
-
-            # process event
-            if next_event.type == EventType.ARRIVAL:
-                self.ProcessArrival(next_event)
-            elif next_event.type == EventType.DEPARTURE:
-                self.ProcessDeparture(next_event)
-            elif next_event.type == EventType.MOVE: #sarah: changed this from VIEWING to MOVE to match rest of code
-                self.ProcessMove(next_event)
-            else:
-                raise Exception("Invalid Event Type")
-
-        #end of sim, print report:
-        #we only want to consider the first customer_number departures, so delete the customers that have not yet departed
-        self.customer = [i for i in self.customer if i.stats.departed]
-        
-        #print([c.id for c in self.customer])
-        self.stats.printStats(self.customer, self.paintings) 
+        while not self.done:
+            self.ProcessNextEvent()
+        self.close_outputs()
+        return self.report()
+
+    # outputs and instrumentation belong to the run that made them, a checkpoint leaves them out
+    NOT_CHECKPOINTED = ("writer", "tracer", "profiler", "dispatch")
+
+    def __getstate__(self):
+        # callables in the instance dict are the profiler's timed methods
+        return {name: value for name, value in self.__dict__.items()
+                if name not in self.NOT_CHECKPOINTED and not callable(value)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.writer = None
+        self.tracer = tracing.PrintTracer() if self.DEBUG else None
+        self.profiler = None
+        self.dispatch = self.dispatchTable()
+        # the profiler's wrappers of the tables' methods aren't restored either
+        for part in (self.paintings, self.paintings.index, self.stats, self.FutureEventList):
+            if part is not None:
+                for name in [name for name, value in vars(part).items() if callable(value)]:
+                    delattr(part, name)
+
+    def checkpoint(self, path: str = None):
+        '''The whole state of the run (clock, future event list, the customers in the gallery,
+        the paintings and their viewers, the random streams and the statistics) as bytes, also
+        written to path if given. GallerySim.restore() of it carries on exactly where this
+        run is, the writer, tracer and profiler aren't part of it.'''
+        data = pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+        if path is not None:
+            with open(path, "wb") as f:
+                f.write(data)
+        return data
+
+    @classmethod
+    def restore(cls, checkpoint, writer=None, tracer=None, profile=False):
+        '''the GallerySim of a checkpoint (the bytes, or the path it was written to). The
+        writer and tracer only get what happens from here on.'''
+        if not isinstance(checkpoint, (bytes, bytearray)):
+            with open(checkpoint, "rb") as f:
+                checkpoint = f.read()
+        sim = pickle.loads(checkpoint)
+        if not isinstance(sim, cls):
+            raise TypeError("not a GallerySim checkpoint")
+        sim.writer = writer
+        if tracer is not None:
+            sim.tracer = tracer
+            tracer.start(sim)
+        if profile:
+            from profiling import SimProfiler
+            sim.profiler = SimProfiler()
+            sim.profiler.install(sim)
+        return sim
+
+    def fork(self, config: SimConfig = None, **changes):
+        '''an independent copy of the run from here on, with config (or the given SimConfig
+        fields, e.g. sim.fork(min_score=120)) from now on, see set_config(). Forks of one
+        warmed-up sim share its past and its random streams, so without changes they carry
+        on exactly like it and with changes they pair like crn runs (see comparison.py).'''
+        sim = GallerySim.restore(self.checkpoint())
+        if config is not None or changes:
+            sim.set_config((config if config is not None else self.config).replace(**changes))
+        return sim
+
+    def set_config(self, config: SimConfig):
+        '''carry on with the model parameters of config. The paintings are already hung so
+        quality_mean and quality_std can't change, the rest apply from now on: customers
+        already in the gallery keep their tolerance, the next arrival is already scheduled
+        and the random values already drawn for the changed parameters are dropped.'''
+        old = self.config
+        if (config.quality_mean, config.quality_std) != (old.quality_mean, old.quality_std):
+            raise ValueError("the paintings are already hung, quality_mean and quality_std can't change")
+        self.config = self.customers.config = config
+        antithetic = (self.variates.antithetic,)
+        if config.interarrival_time_mean != old.interarrival_time_mean:
+            self.interarrival_times.redraw((config.interarrival_time_mean,) + antithetic)
+        if (config.tolerance_mean, config.tolerance_std) != (old.tolerance_mean, old.tolerance_std):
+            self.tolerances.redraw((config.tolerance_mean, config.tolerance_std) + antithetic)
+        if (config.interarrival_time_mean, config.tolerance_mean, config.tolerance_std) != \
+                (old.interarrival_time_mean, old.tolerance_mean, old.tolerance_std):
+            self.arrivals.redraw()
+        self.viewing_time_args = (config.viewing_time_mean, config.viewing_time_std)
+        if (config.viewing_time_mean, config.viewing_time_std) != (old.viewing_time_mean, old.viewing_time_std):
+            self.viewing_times.redraw(self.viewing_time_args + antithetic)
+            for stream in (self.customer_viewing_times or {}).values():
+                stream.redraw(self.viewing_time_args + antithetic)
+        self.paintings.set_config(config)
+        if self.paintings.index is not None and config.quality_constant != old.quality_constant:
+            # the index is ordered by quality score, rebuild it and tell it what everyone has seen
+            self.paintings.build_index()
+            customers = self.customers
+            for id in np.flatnonzero(customers.arrived[:len(customers)] & ~customers.departed[:len(customers)]).tolist():
+                for painting in np.flatnonzero(customers.viewed_mask(id)).tolist():
+                    self.paintings.index.mark_viewed(id, painting)
+
+    def close_outputs(self):
+        '''write the paintings' records, close the writer and the tracer (run() does this when it finishes)'''
+        if self.writer is not None and not self.writer.closed:
+            self.writer.write_paintings(self.paintings, self.stats.num_painting_views)
+            self.writer.close()
+        if self.tracer is not None:
+            self.tracer.close()
+
+    def report(self):
+        '''SimReport of the run so far, print it for the text report'''
+        #we only want to consider the first customer_number departures, so the report leaves out the customers that have not yet departed
         # print('\n customer stats:')
         # print(['arrival time %.4f, depart time: %.4f, num paintings: %.4f, total view time: %.4f '
-        #       %(c.stats.arrival_time, c.stats.departure_time, c.stats.num_paintings_viewed, c.stats.total_viewing_time) for c in self.customer])
-        # print('customer score histories: ', [ str(c.stats.score_history) for c in self.customer])
-
-
-    def generateInterArrivalTime(self):
-        return np.clip(self.rng.exponential(INTERARRIVAL_TIME_MEAN), 0.00001, 100)
-        #, INTERARRIVAL_TIME_STD)
-        #sarah: rng.exponential takes parameters scale: float, and size: (int or tuple of ints).
-        #   doesn't take a parameter for std dev because it is calculated from the rate (ie. std=mean)
-
-    # def generateViewingTime(self):
-    #     return np.clip(self.rng.normal(VIEWING_TIME_MEAN, VIEWING_TIME_STD), 0.00001, 100)
-
-    # def generateTolerance(self):
-    #     return self.rng.normal(TOLERANCE_MEAN, TOLERANCE_STD)
-
+        #       %(c.stats.arrival_time, c.stats.departure_time, c.stats.num_paintings_viewed, c.stats.total_viewing_time) for c in self.customers if c.stats.departed])
+        return self.stats.report(self.customers, self.paintings)
+
+    def dispatchTable(self):
+        '''the method that processes each EventType, indexed by its value'''
+        return (self.ProcessArrival, self.ProcessDeparture, self.ProcessMove)
+
+    def nextEventTime(self):
+        '''time of the next event (the next arrival or the first event on the FEL), None if there is none'''
+        next_event = self.FutureEventList.getMin()
+        if self.next_arrival is None:
+            return next_event.time if next_event is not None else None
+        if next_event is None:
+            return self.next_arrival.time
+        return min(self.next_arrival.time, next_event.time)
+
+    def ProcessNextEvent(self):
+        # the next arrival comes first if it is earlier than the FEL's first event (or at the same
+        # time but scheduled before it)
+        arrival = self.next_arrival
+        if arrival is not None:
+            fel = self.FutureEventList
+            first = fel.getMin()
+            if first is None or arrival.time < first.time or (
+                    arrival.time == first.time and (arrival.time, self.next_arrival_seq) < fel.getMinKey()):
+                self.next_arrival = None
+                self.time = arrival.time
+                self.dispatch[EventType.ARRIVAL](arrival)
+                return
+
+        # get next event
+        next_event = self.FutureEventList.dequeue()
+        self.time = next_event.time
+
+        # process event
+        try:
+            handler = self.dispatch[next_event.type]
+        except (IndexError, TypeError):
+            raise Exception("Invalid Event Type")
+        handler(next_event)
+
+
+    def generateViewingTime(self, customer: int):
+        if self.customer_viewing_times is not None:
+            return self.customer_viewing_times[customer].next()
+        return self.viewing_times.next()
 
 
     def ProcessArrival(self, evt: Event):
         # So when the customer first arrives we basically just want to record the arrival then "move" them to their first painting
-        evt.customer.stats.arrived = True
+        customers = self.customers
+        customers.arrived[evt.customer] = True
         self.stats.num_arrived += 1
-        evt.customer.stats.arrival_time = evt.time #update stats for this customer 
+        customers.arrival_time[evt.customer] = evt.time #update stats for this customer 
+        if self.tracer is not None:
+            self.tracer.record(evt.time, tracing.ARRIVAL, customers.number[evt.customer], -1, math.nan, customers.tolerance[evt.customer],
+                               customers.favorite_style[evt.customer])
+        if self.customer_viewing_times is not None:
+            self.customer_viewing_times[evt.customer] = self.variates.customer_stream("viewing_time", int(customers.number[evt.customer]),
+                                                                                      drawViewingTimes, self.viewing_time_args)
 
         #if statements to count number of favourite styles
-        if evt.customer.favorite_style == 0: #BAROQUE
+        favorite_style = customers.favorite_style[evt.customer]
+        if favorite_style == 0: #BAROQUE
             self.stats.num_baroque += 1
-        elif evt.customer.favorite_style == 1: #IMPRESSIONIST
+        elif favorite_style == 1: #IMPRESSIONIST
             self.stats.num_impressionist += 1
-        elif evt.customer.favorite_style == 2: #MODERN  
+        elif favorite_style == 2: #MODERN  
             self.stats.num_modern += 1
-        elif evt.customer.favorite_style == 3: #ABSTRACT
+        elif favorite_style == 3: #ABSTRACT
             self.stats.num_abstract += 1 
 
         #process initial move (this occurs immidiately after customer arrives)
@@ -439,22 +1094,26 @@ class GallerySim:
 
 
     def ScheduleArrival(self):
-        # Scheduling the next arrival        
-        if(self.stats.num_arrived >= self.num_customers):
+        # Scheduling the next arrival, its time and customer come from the precomputed arrival stream
+        arrival = self.arrivals.next()
+        if arrival is None:
             return
-        
-        next_arrival_time = self.time + self.generateInterArrivalTime()
+        next_arrival_time, favorite_style, tolerance = arrival
 
-        new_cust = Customer(self.num_paintings, self.rng) #sarah: added rng
-        new_cust.arrival_time = next_arrival_time
+        new_cust = self.customers.add(favorite_style, tolerance)
 
-        # create the next arrival event
-        arrival_event = Event(EventType.ARRIVAL, next_arrival_time, new_cust)
-
-        self.customer.append(new_cust)
+        # create the next arrival event, from a departed customer's Event if there is one
+        if self.event_pool:
+            arrival_event = self.event_pool.pop()
+            arrival_event.type = EventType.ARRIVAL
+            arrival_event.time = next_arrival_time
+            arrival_event.customer = new_cust
+        else:
+            arrival_event = Event(EventType.ARRIVAL, next_arrival_time, new_cust)
 
-        ## add the arrival to the future event list
-        self.FutureEventList.enqueue(arrival_event)
+        ## the arrival waits outside the future event list, see ProcessNextEvent
+        self.next_arrival = arrival_event
+        self.next_arrival_seq = self.FutureEventList.reserve()
 
 
     def ProcessDeparture(self, evt: Event):
@@ -462,10 +1121,21 @@ class GallerySim:
         # so the event will have already been removed from futureEventsList
         #all we need to do is update stats:
         self.stats.num_departed += 1
-        evt.customer.stats.departure_time = evt.time
-        evt.customer.stats.departed = True
-        if(self.DEBUG):
-            print('customer', evt.customer.id, 'leaving')
+        self.customers.departure_time[evt.customer] = evt.time
+        self.customers.departed[evt.customer] = True
+        if self.customers.saw_favorite_style[evt.customer]:
+            self.stats.num_saw_favorite_style += 1
+        if self.writer is not None:
+            self.writer.add_customer(self.customers, evt.customer)
+        if self.paintings.index is not None:
+            self.paintings.index.forget(evt.customer)
+        if self.customer_viewing_times is not None:
+            del self.customer_viewing_times[evt.customer]
+        # nothing refers to the customer any more, their row goes to the next arrival
+        if self.retire_customers:
+            self.customers.retire(evt.customer)
+        # and so does their Event (ProcessArrival may take it straight back for the next arrival)
+        self.event_pool.append(evt)
 
 
 
@@ -474,32 +1144,49 @@ class GallerySim:
         # Min score at which point the customer will leave instead of going to the next painting
 
         customer = evt.customer
+        customers = self.customers
+        num_paintings_viewed = customers.num_paintings_viewed[customer]
 
         #sarah: if customer is already at a painting, need to decrease that painting's num_viewers since somebody is leaving
-        if(customer.stats.num_paintings_viewed > 0):
-            prev_painting = customer.current_painting #customer.stats.score_history[-1][0]
-            prev_painting.num_viewers -= 1
+        if(num_paintings_viewed > 0):
+            prev_painting = customers.current_painting[customer]
+            self.paintings.set_num_viewers(prev_painting, self.paintings.num_viewers[prev_painting] - 1, self.time)
             # if(DEBUG):
-            #     print(customer.id,' left painting', prev_painting.id, 'now there are %d viewers' %prev_painting.num_viewers)
+            #     print(customer,' left painting', prev_painting, 'now there are %d viewers' %self.paintings.num_viewers[prev_painting])
         
         # get the painting with the highest score
-        painting_scores = np.array([customer.scorePainting(p) for p in self.paintings])
-        if(DEBUG):
-            print(painting_scores)
+        walking_time = 0.0
+        if self.layout is not None:
+            # only the paintings within walking distance of where the customer is standing
+            candidates, distances = self.layout.candidates(customers.current_painting[customer] if num_paintings_viewed > 0 else -1)
+            painting_scores = self.paintings.scores(customers.viewed_of(customer, candidates), customers.tolerance[customer],
+                                                    customers.favorite_style[customer], candidates)
+            self.stats.addPaintingScores(painting_scores[painting_scores > 0])
+            if len(candidates):
+                best = np.argmax(painting_scores)
+                bestIndex, best_score = candidates[best], painting_scores[best]
+                walking_time = distances[best] / self.layout.walking_speed
+            else:
+                bestIndex, best_score = -1, -1
+        elif self.selection == "scan":
+            painting_scores = self.paintings.scores(customers.viewed_mask(customer), customers.tolerance[customer], customers.favorite_style[customer])
 
-        self.stats.painting_scores.extend([x for x in painting_scores if x > 0])
+            self.stats.addPaintingScores(painting_scores[painting_scores > 0])
 
-        bestIndex = np.argmax(painting_scores)
-        best_painting = self.paintings[bestIndex]
+            bestIndex = np.argmax(painting_scores)
+            best_score = painting_scores[bestIndex]
+        else:
+            bestIndex, best_score = self.paintings.best(customers, customer)
 
-        if(painting_scores[bestIndex] < MIN_SCORE):
+        if(best_score < self.config.min_score):
             # If the person is leaving early
-            if(customer.stats.num_paintings_viewed < self.num_paintings):
+            if(num_paintings_viewed < self.num_paintings):
                 self.stats.num_leave_early += 1
-                self.stats.num_customers_leave_early[customer.stats.num_paintings_viewed] += 1
-                self.stats.leave_early_scores.append(painting_scores[bestIndex])
-                self.stats.num_painting_left_leave_early += self.stats.num_paintings - customer.stats.num_paintings_viewed
-            
+                self.stats.num_customers_leave_early[num_paintings_viewed] += 1
+                self.stats.addLeaveEarlyScore(best_score)
+                self.stats.num_painting_left_leave_early += self.stats.num_paintings - num_paintings_viewed
+            if self.tracer is not None:
+                self.tracer.record(self.time, tracing.DEPARTURE, customers.number[customer], bestIndex, best_score, num_paintings_viewed, -1)
 
             # EVent is now a departure
             evt.type = EventType.DEPARTURE
@@ -508,32 +1195,39 @@ class GallerySim:
 
         #add view number to painting
         self.stats.num_painting_views[bestIndex] += 1
-        if(DEBUG):
-            print(self.stats.num_painting_views)
 
         #check if customer is seeing their favourite style
-        if(best_painting.style == evt.customer.favorite_style):
-            customer.stats.saw_favorite_style = True
+        if(self.paintings.style[bestIndex] == customers.favorite_style[customer]):
+            customers.saw_favorite_style[customer] = True
 
             #keep track of total number of attraciveness levels when all customers see their favourite style
-            self.stats.attractiveness_for_favourite += customer.scorePainting(best_painting)
+            self.stats.attractiveness_for_favourite += best_score
 
 
         # begin viewing the painting
-        viewing_time = customer.beginViewing(best_painting, self.time)
-        customer.viewedPaintings[bestIndex] = True
-        customer.current_painting = best_painting
+        self.paintings.set_num_viewers(bestIndex, self.paintings.num_viewers[bestIndex] + 1, self.time)
+        viewing_time = self.generateViewingTime(customer)
+        customers.mark_viewed(customer, bestIndex)
+        if self.paintings.index is not None:
+            self.paintings.index.mark_viewed(customer, bestIndex)
+        customers.current_painting[customer] = bestIndex
+        if self.tracer is not None:
+            self.tracer.record(self.time, tracing.MOVE, customers.number[customer], bestIndex, best_score, viewing_time, self.paintings.style[bestIndex])
 
         ## add viewing time to stats
         self.stats.total_viewing_time += viewing_time
         self.stats.num_paintings_viewed += 1
 
-        # Schedule the next MOVE (sarah: for this customer right?)
-        self.FutureEventList.enqueue(Event(EventType.MOVE, self.time + viewing_time, customer))
+        if self.layout is not None:
+            self.stats.total_walking_time += walking_time
+
+        # Schedule the next MOVE (sarah: for this customer right?), the event just processed is reused for it
+        evt.time = self.time + walking_time + viewing_time
+        self.FutureEventList.enqueue(evt)
 
-        customer.stats.total_viewing_time += viewing_time
-        customer.stats.num_paintings_viewed += 1
-        customer.stats.score_history.append((best_painting, painting_scores[bestIndex])) #adding as tuple so we can keep track of both
+        customers.total_viewing_time[customer] += viewing_time
+        customers.num_paintings_viewed[customer] += 1
+        customers.add_score(customer, self.paintings[bestIndex], best_score)
 
         return
 
@@ -541,7 +1235,9 @@ class GallerySim:
 def main():
     '''Produce data for multiple scenarios (for each scenario, run simulation w/ 5 different initial random seeds)
         and process collected data.'''
-    test = GallerySim(50,1000,20, False)
+    from replications import run_replications
+    results = run_replications(50, 1000, num_replications=5, seed=20)
+    print(results)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,231 @@
+import math
+
+import numpy as np
+
+import scoring
+from replications import spawn_seeds
+from sweep import SweepResults, run_sweep
+from variates import VariateSupply
+
+
+## Mean-field screening model of the gallery, for getting rough answers over a large design
+## in seconds and keeping GallerySim for the promising points.
+##
+## Customers arrive at rate 1/interarrival_time_mean and view each painting for
+## viewing_time_mean on average, so by Little's law painting j has on average
+## n_j = rate * viewing time * (probability a customer views j) viewers. Like the viewers of
+## an infinite-server queue the number a customer finds there is taken to be Poisson(n_j).
+## A customer views, best first, every painting whose score (scoring.quality_scores +
+## viewer_scores + style_scores) clears min_score, so the probability they view j is the
+## probability that few enough others are in front of it. That makes the n_j a fixed point,
+## which is found by damped iteration for every point of the design at once. Tolerances are
+## integrated out with Gauss-Hermite nodes and favourite styles are averaged over.
+## The paintings are drawn from the seed exactly like GallerySim draws them, so a prediction
+## is for the same gallery as a simulation run from the same seed. Walking (layouts) and the
+## warm-up of a finite run aren't modelled, validate() measures how far off that leaves it.
+
+NUM_STYLES = 4
+# the predictions, named like the SimReport metrics they predict
+METRICS = ["percent_paintings_viewed", "percent_leave_early", "percent_saw_favorite_style",
+           "average_views_per_painting"]
+
+
+def _paintings(seed, num_paintings: int, quality_mean: float, quality_std: float):
+    # the same streams GallerySim draws its paintings from
+    import main
+    supply = VariateSupply(seed)
+    style = supply.stream("painting_style", main.drawStyles).take(num_paintings)
+    quality = supply.stream("painting_quality", main.drawQualities, (quality_mean, quality_std)).take(num_paintings)
+    return style, quality
+
+
+def _min_viewers_cut(tolerance, needed, patience_constant, max_viewers: int):
+    '''how many viewer counts k = 0, 1, ... give a viewer score of at least needed, capped at
+    max_viewers + 1 (which stands for any number). viewer_scores is 100 * patience /
+    max(sqrt(k) / tolerance, 1), so that is every k up to (tolerance * 100 * patience / needed)^2.'''
+    top = 100 * patience_constant
+    with np.errstate(divide="ignore", invalid="ignore"):
+        limit = np.floor((tolerance * top / needed) ** 2) + 1
+    cut = np.where(needed <= 0, max_viewers + 1, np.where(needed > top, 0, np.minimum(limit, max_viewers + 1)))
+    return cut.astype(np.int64)
+
+
+def _poisson_cdf(mean, max_viewers: int):
+    '''(..., max_viewers + 2) array: P(N < c) for c = 0..max_viewers + 1 of N ~ Poisson(mean),
+    the last one taken as 1 (the tail beyond max_viewers counts as any number)'''
+    k = np.arange(max_viewers + 1)
+    log_factorial = np.concatenate([[0.0], np.cumsum(np.log(np.arange(1, max_viewers + 1)))])
+    mean = mean[..., None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pmf = np.where(mean > 0, np.exp(k * np.log(mean) - mean - log_factorial), (k == 0).astype(float))
+    cdf = np.zeros(mean.shape[:-1] + (max_viewers + 2,))
+    np.cumsum(pmf, axis=-1, out=cdf[..., 1:])
+    cdf[..., -1] = 1.0
+    return np.minimum(cdf, 1.0)
+
+
+def _solve_chunk(configs, style, quality_scores, num_customers, tolerance_nodes, max_iterations, damping, tol):
+    G, P = quality_scores.shape
+    x, w = np.polynomial.hermite_e.hermegauss(tolerance_nodes)
+    w = w / w.sum()
+    column = lambda name: np.array([getattr(c, name) for c in configs], dtype=float)[:, None]
+    tolerance = np.clip(column("tolerance_mean") + column("tolerance_std") * x, 0.000001, 100)  # (G, T)
+    viewing_time = np.clip(column("viewing_time_mean") + column("viewing_time_std") * x, 0.000001, 100) @ w  # (G,)
+    rate = 1 / column("interarrival_time_mean")[:, 0]
+    # nobody can be viewing a painting more often than every customer views it
+    most_viewers = rate * viewing_time
+    max_viewers = int(math.ceil(most_viewers.max() + 10 * math.sqrt(most_viewers.max()) + 10))
+
+    # score of each painting before the viewers, (G, styles, P), and what the viewers must add to clear min_score
+    favorite = np.arange(NUM_STYLES)[:, None]
+    base = quality_scores[:, None, :] + scoring.style_scores(style[None, :], favorite, 1) * column("style_constant")[:, :, None]
+    needed = column("min_score")[:, :, None] - base
+    # (G, T, styles, P): viewer counts at which the painting is still good enough, fixed for the whole iteration
+    cut = _min_viewers_cut(tolerance[:, :, None, None], needed[:, None, :, :],
+                           column("patience_constant")[:, :, None, None], max_viewers)
+    g_index = np.arange(G)[:, None, None, None]
+    p_index = np.arange(P)[None, None, None, :]
+
+    def view_probability(load):
+        return _poisson_cdf(load, max_viewers)[g_index, p_index, cut]
+
+    load = np.zeros((G, P))
+    iterations = np.zeros(G, dtype=np.int64)
+    active = np.ones(G, dtype=bool)
+    for i in range(max_iterations):
+        viewed = view_probability(load)
+        # averaged over favourite styles (equally likely) and tolerances
+        new_load = (rate * viewing_time)[:, None] * np.einsum("gtsp,t->gp", viewed, w) / NUM_STYLES
+        change = np.max(np.abs(new_load - load), axis=1)
+        load = np.where(active[:, None], load + damping * (new_load - load), load)
+        iterations[active] += 1
+        active &= change > tol * (1 + np.max(load, axis=1))
+        if not active.any():
+            break
+
+    viewed = view_probability(load)
+    paintings_viewed = np.einsum("gtsp,t->g", viewed, w) / NUM_STYLES
+    # every painting viewed, taking the paintings as independent
+    with np.errstate(divide="ignore"):
+        saw_all = np.exp(np.log(viewed).sum(axis=3))
+    same_style = (style[None, :] == np.arange(NUM_STYLES)[:, None])  # (styles, P)
+    saw_none_of_favorite = np.prod(np.where(same_style[None, None], 1 - viewed, 1.0), axis=3)
+    rows = {
+        "percent_paintings_viewed": paintings_viewed / P * 100,
+        "percent_leave_early": (1 - np.einsum("gts,t->g", saw_all, w) / NUM_STYLES) * 100,
+        "percent_saw_favorite_style": (1 - np.einsum("gts,t->g", saw_none_of_favorite, w) / NUM_STYLES) * 100,
+        "average_views_per_painting": np.asarray(num_customers, dtype=float) * paintings_viewed / P,
+        "average_viewing_time": viewing_time,
+        "mean_occupancy": load.sum(axis=1),
+    }
+    return rows, load, iterations, ~active
+
+
+class MeanFieldResults(SweepResults):
+    '''One row per point of the design: the point's index, its full configuration, the
+    predictions (METRICS, plus average_viewing_time and mean_occupancy, the average number of
+    customers in the gallery), the iterations taken and whether the fixed point converged.
+    load is the (points, paintings) array of the average number of viewers of each painting.'''
+
+    def __init__(self, rows, load):
+        super().__init__(rows)
+        self.load = load
+
+
+def solve(points, num_paintings: int = 50, num_customers: int = 1000, replications: int = 1, seed=None,
+          base_config=None, tolerance_nodes: int = 16, max_iterations: int = 500, damping: float = 0.5,
+          tol: float = 1e-6, chunk_size: int = 256):
+    '''Mean-field predictions for every point of a design (a list of dicts of SimConfig
+    fields and optionally num_customers, like sweep.run_sweep takes; num_paintings is the same
+    for the whole design). The predictions are averaged over the galleries of `replications`
+    seeds spawned from seed, the ones run_sweep with the same seed and replications simulates.
+    Points are solved chunk_size at a time.'''
+    import main
+    base_config = base_config if base_config is not None else main.SimConfig()
+    configs, customers = [], []
+    for point in points:
+        point = dict(point)
+        if int(point.pop("num_paintings", num_paintings)) != num_paintings:
+            raise ValueError("the mean-field model solves one gallery size at a time, num_paintings can't vary")
+        customers.append(int(point.pop("num_customers", num_customers)))
+        configs.append(base_config.replace(**point))
+    customers = np.array(customers, dtype=float)
+
+    predictions = {}
+    load = np.zeros((len(configs), num_paintings))
+    iterations = np.zeros(len(configs), dtype=np.int64)
+    converged = np.ones(len(configs), dtype=bool)
+    for child in spawn_seeds(seed, replications):
+        drawn = {}  # (quality_mean, quality_std) -> (style, quality) of this seed's gallery
+        for start in range(0, len(configs), chunk_size):
+            chunk = configs[start:start + chunk_size]
+            quality_scores = []
+            for config in chunk:
+                key = (config.quality_mean, config.quality_std)
+                if key not in drawn:
+                    drawn[key] = _paintings(child, num_paintings, *key)
+                style, quality = drawn[key]
+                quality_scores.append(scoring.quality_scores(quality, config.quality_constant))
+            rows, chunk_load, chunk_iterations, chunk_converged = _solve_chunk(
+                chunk, style, np.array(quality_scores), customers[start:start + chunk_size], tolerance_nodes,
+                max_iterations, damping, tol)
+            for name, values in rows.items():
+                predictions.setdefault(name, np.zeros(len(configs)))[start:start + len(chunk)] += values / replications
+            load[start:start + len(chunk)] += chunk_load / replications
+            iterations[start:start + len(chunk)] = np.maximum(iterations[start:start + len(chunk)], chunk_iterations)
+            converged[start:start + len(chunk)] &= chunk_converged
+
+    rows = []
+    for i, config in enumerate(configs):
+        row = {"point": i, "num_paintings": num_paintings, "num_customers": int(customers[i])}
+        row.update(config.as_dict())
+        row.update((name, float(values[i])) for name, values in predictions.items())
+        row["iterations"] = int(iterations[i])
+        row["converged"] = bool(converged[i])
+        rows.append(row)
+    return MeanFieldResults(rows, load)
+
+
+class MeanFieldValidation:
+    '''Mean-field predictions against GallerySim at the same points: per metric the predicted
+    and simulated values of every sampled point and the mean and max absolute error.'''
+
+    def __init__(self, points, predicted: MeanFieldResults, simulated: SweepResults, metrics=METRICS):
+        self.points = points
+        self.predicted = predicted
+        self.simulated = simulated
+        self.metrics = list(metrics)
+        sim_point = simulated.column("point")
+        # metric -> (predicted per point, simulated mean per point)
+        self.values = {}
+        self.errors = {}
+        for metric in self.metrics:
+            simulated_values = simulated.column(metric).astype(float)
+            means = np.array([np.nanmean(simulated_values[sim_point == i]) for i in range(len(points))])
+            self.values[metric] = (predicted.column(metric).astype(float), means)
+            error = np.abs(self.values[metric][0] - means)
+            self.errors[metric] = {"mean_absolute_error": float(np.nanmean(error)), "max_absolute_error": float(np.nanmax(error))}
+
+    def __str__(self):
+        lines = ["Mean-field model against GallerySim at {} points:".format(len(self.points))]
+        lines.append("{:<32} {:>10} {:>10}".format("metric", "mean |err|", "max |err|"))
+        for metric in self.metrics:
+            e = self.errors[metric]
+            lines.append("{:<32} {:>10.3f} {:>10.3f}".format(metric, e["mean_absolute_error"], e["max_absolute_error"]))
+        return "\n".join(lines)
+
+
+def validate(points, sample: int = 10, num_paintings: int = 50, num_customers: int = 1000, replications: int = 3,
+             seed=None, workers=None, base_config=None, cache=None, **solve_kwargs):
+    '''Simulate `sample` points spread evenly over the design (with sweep.run_sweep, so the
+    runs can be cached) and compare them with the mean-field predictions for the same galleries.'''
+    points = list(points)
+    chosen = sorted(set(np.linspace(0, len(points) - 1, min(sample, len(points))).round().astype(int).tolist()))
+    sampled = [points[i] for i in chosen]
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    # spawning counts the children already made, so each side gets its own copy of the seed to get the same galleries
+    copy = lambda: np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key)
+    simulated = run_sweep(sampled, num_paintings, num_customers, replications, copy(), workers, base_config, cache=cache)
+    predicted = solve(sampled, num_paintings, num_customers, replications, copy(), base_config, **solve_kwargs)
+    return MeanFieldValidation(sampled, predicted, simulated)
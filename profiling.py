@@ -0,0 +1,221 @@
+import time
+
+
+## Optional instrumentation of a GallerySim run, GallerySim(profile=True).
+## SimProfiler wraps ProcessNextEvent on that one sim instance, so a sim that isn't profiled
+## runs exactly the same code as before. The wrapper times every event (exact event counts,
+## wall time and events/s) and every sample_every-th event it also swaps timed versions of
+## the hot methods (ProcessMove, the FEL operations, scoring, the stats updates, ...) in for
+## that one event, which gives the split of the time between the phases at a fraction of
+## the cost of timing every call. Phase times are exclusive (ProcessMove's time doesn't
+## include the scoring or FEL calls made from it) and the cost of the timing itself is
+## measured once and left out.
+
+class CallCounter:
+    '''function wrapped so every call is counted, a class rather than a closure so a profiled
+    sim can still be checkpointed'''
+
+    def __init__(self, function):
+        self.function = function
+        self.calls = 0
+
+    def __call__(self, *args):
+        self.calls += 1
+        return self.function(*args)
+
+
+class SimProfiler:
+    '''Event counts, events/s, FEL size over time, scoring calls and the time split between
+    the phases of the event loop of one run.'''
+
+    def __init__(self, sample_every: int = 16, fel_sample_every: int = 100):
+        self.sample_every = sample_every
+        self.fel_sample_every = fel_sample_every
+        self.num_events = 0  # ProcessNextEvent calls, arrivals from the arrival stream and the rest off the FEL
+        self.wall_time = 0.0  # seconds spent processing them
+        self.sampled_events = 0
+        self.sampled_time = 0.0
+        self.phase_time = {}  # exclusive seconds per phase, sampled events only
+        self.phase_calls = {}
+        self.fel_samples = []  # (sim time, FEL size) every fel_sample_every events
+        self.fel_max = 0  # largest FEL size seen in the samples
+        self.sim = None
+        self.scoring_counters = []  # CallCounters of PaintingTable.scores and best
+        # time spent in timed children of each open timed call
+        self._child_time = [0.0]
+        self._overhead = 0.0
+        self._overhead = self._measure_overhead()
+
+    def _measure_overhead(self, n: int = 20000):
+        # seconds a timed call adds around the call itself, as seen by the caller
+        saved = self.phase_time, self.phase_calls, self._child_time
+        self.phase_time, self.phase_calls, self._child_time = {}, {}, [0.0]
+        nothing = lambda: None
+        timed_nothing = self.timed("calibration", nothing)
+        start = time.perf_counter()
+        for i in range(n):
+            timed_nothing()
+        total = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(n):
+            nothing()
+        bare = time.perf_counter() - start
+        self.phase_time, self.phase_calls, self._child_time = saved
+        return max(total - bare, 0.0) / n
+
+    def timed(self, phase: str, function):
+        '''function wrapped so its calls are counted and timed under phase'''
+        perf_counter = time.perf_counter
+        child_time = self._child_time
+        phase_time = self.phase_time
+        phase_calls = self.phase_calls
+        phase_time.setdefault(phase, 0.0)
+        phase_calls.setdefault(phase, 0)
+        overhead = self._overhead
+
+        def wrapper(*args):
+            child_time.append(0.0)
+            start = perf_counter()
+            result = function(*args)
+            elapsed = perf_counter() - start
+            phase_time[phase] += elapsed - child_time.pop()
+            phase_calls[phase] += 1
+            child_time[-1] += elapsed + overhead
+            return result
+        return wrapper
+
+    def install(self, sim):
+        '''start profiling sim (a GallerySim)'''
+        self.sim = sim
+        fel = sim.FutureEventList
+        # scores and best are counted on every event, the timed versions wrap the counted ones
+        self.scoring_counters = [CallCounter(getattr(sim.paintings, name)) for name in ("scores", "best")]
+        for name, counter in zip(("scores", "best"), self.scoring_counters):
+            setattr(sim.paintings, name, counter)
+        painting_methods = {"scores": "scoring", "best": "scoring"}
+        if sim.paintings.occupancy is not None:
+            # every change of viewers updates the occupancy statistics, so set_num_viewers is its own phase
+            painting_methods["set_num_viewers"] = "occupancy"
+        # (object, {method name: phase}) of the methods timed on sampled events
+        targets = [
+            (sim, {"ProcessArrival": "arrival", "ScheduleArrival": "arrival", "ProcessDeparture": "departure",
+                   "ProcessMove": "move bookkeeping"}),
+            (fel, {"enqueue": "fel", "dequeue": "fel", "getMin": "fel", "getMinKey": "fel", "reserve": "fel"}),
+            (sim.paintings, painting_methods),
+            (sim.stats, {"addPaintingScores": "stats", "addLeaveEarlyScore": "stats"}),
+        ]
+        if sim.paintings.index is not None:
+            # the index's share of set_num_viewers is its update (without occupancy statistics the
+            # rest of it is an array store, left in move bookkeeping)
+            targets.append((sim.paintings.index, {"update": "selection index upkeep", "mark_viewed": "selection index upkeep",
+                                                  "forget": "selection index upkeep"}))
+        # (instance dict, timed versions, plain versions), swapped in and out around sampled events
+        swaps = []
+        for target, methods in targets:
+            plain = {name: getattr(target, name) for name in methods}
+            timed = {name: self.timed(phase, plain[name]) for name, phase in methods.items()}
+            swaps.append((target.__dict__, timed, plain))
+
+        # ProcessNextEvent calls the handlers through sim.dispatch, which needs the timed handlers too
+        attributes, timed, plain = swaps[0]
+        plain["dispatch"] = sim.dispatch
+        attributes.update(timed)
+        timed["dispatch"] = sim.dispatchTable()
+        attributes.update(plain)
+
+        process_next_event = sim.ProcessNextEvent
+        perf_counter = time.perf_counter
+        child_time = self._child_time
+
+        def profiled_next_event():
+            self.num_events += 1
+            if self.num_events % self.fel_sample_every == 0:
+                size = len(fel)
+                self.fel_samples.append((sim.time, size))
+                if size > self.fel_max:
+                    self.fel_max = size
+            if self.num_events % self.sample_every:
+                start = perf_counter()
+                process_next_event()
+                self.wall_time += perf_counter() - start
+                return
+            for attributes, timed, plain in swaps:
+                attributes.update(timed)
+            child_time[0] = 0.0
+            start = perf_counter()
+            process_next_event()
+            elapsed = perf_counter() - start
+            for attributes, timed, plain in swaps:
+                attributes.update(plain)
+            # the time of the event not spent in a timed call is the dispatch in ProcessNextEvent
+            self.phase_time["event dispatch"] = self.phase_time.get("event dispatch", 0.0) + max(elapsed - child_time[0], 0.0)
+            self.phase_calls["event dispatch"] = self.phase_calls.get("event dispatch", 0) + 1
+            self.sampled_events += 1
+            self.sampled_time += elapsed
+            self.wall_time += elapsed
+        sim.ProcessNextEvent = profiled_next_event
+
+    @property
+    def events(self):
+        '''event type name -> number processed, counted like the benchmarks count them: every
+        arrival, every view of a painting and every departure (a departure is decided on the
+        move that would have been the customer's next view)'''
+        stats = self.sim.stats if self.sim is not None else None
+        return {
+            "ARRIVAL": stats.num_arrived if stats is not None else 0,
+            "MOVE": stats.num_paintings_viewed if stats is not None else 0,
+            "DEPARTURE": stats.num_departed if stats is not None else 0,
+        }
+
+    @property
+    def total_events(self):
+        return sum(self.events.values())
+
+    @property
+    def events_per_second(self):
+        return self.total_events / self.wall_time if self.wall_time > 0 else float("nan")
+
+    @property
+    def scoring_calls(self):
+        '''calls to PaintingTable.scores and PaintingTable.best'''
+        return sum(counter.calls for counter in self.scoring_counters)
+
+    def phase_fractions(self):
+        '''phase -> share of the sampled time'''
+        total = sum(self.phase_time.values())
+        return {phase: seconds / total if total > 0 else 0.0 for phase, seconds in self.phase_time.items()}
+
+    def summary(self):
+        '''the profile as a dict, phase_time is the estimated seconds of each phase in the whole run'''
+        fractions = self.phase_fractions()
+        return {
+            "wall_time": self.wall_time,
+            "events": self.events,
+            "total_events": self.total_events,
+            "events_per_second": self.events_per_second,
+            "scoring_calls": self.scoring_calls,
+            "fel_max_size": self.fel_max,
+            "fel_samples": list(self.fel_samples),
+            "sampled_events": self.sampled_events,
+            "phase_time": {phase: fraction * self.wall_time for phase, fraction in fractions.items()},
+            "phase_fraction": fractions,
+        }
+
+    def __str__(self):
+        lines = ["Profile:"]
+        lines.append("Events: {} ({})".format(self.total_events, ", ".join(
+            "{} {}".format(name, count) for name, count in self.events.items())))
+        lines.append("Wall time: {:.3f}s, {:.0f} events/s".format(self.wall_time, self.events_per_second))
+        lines.append("Scoring calls: {}".format(self.scoring_calls))
+        if self.fel_samples:
+            sizes = [size for t, size in self.fel_samples]
+            lines.append("FEL size: max {}, mean {:.1f} (sampled every {} events)".format(
+                self.fel_max, sum(sizes) / len(sizes), self.fel_sample_every))
+        lines.append("Time per phase (timed on 1 in {} events, {} events):".format(self.sample_every, self.sampled_events))
+        lines.append("{:<24} {:>10} {:>7} {:>10}".format("phase", "seconds", "%", "us/call"))
+        fractions = self.phase_fractions()
+        for phase, fraction in sorted(fractions.items(), key=lambda item: -item[1]):
+            calls = self.phase_calls[phase]
+            lines.append("{:<24} {:>10.3f} {:>6.1f}% {:>10.2f}".format(
+                phase, fraction * self.wall_time, 100 * fraction, 1e6 * self.phase_time[phase] / calls if calls else 0))
+        return "\n".join(lines)
@@ -0,0 +1,202 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from confidence import mean_confidence_interval
+from resultcache import open_cache, run_key
+
+
+## Independent replications of GallerySim spread over a process pool.
+## Each replication gets its own child of one np.random.SeedSequence, so the streams are
+## independent and replication i always gets the same seed no matter how many workers run.
+
+def run_replication(num_paintings: int, num_customers: int, seed, sim_kwargs=None):
+    '''run one GallerySim and return its SimReport'''
+    import main  # main imports this module for main(), so import it lazily
+    return main.GallerySim(num_paintings, num_customers, seed, **(sim_kwargs or {})).run()
+
+
+def _run_task(task):
+    return run_replication(*task)
+
+
+def map_tasks(function, tasks, workers=None):
+    '''function(task) for every task, in order. workers=None uses every core, workers=1 runs in this process.'''
+    tasks = list(tasks)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        return [function(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, tasks))
+
+
+def run_cached(tasks, workers=None, cache=None, pool=None):
+    '''SimReports of (num_paintings, num_customers, seed, sim_kwargs) tasks, in order.
+    Tasks found in the cache (a ResultCache or its path) aren't run again, the rest are run
+    over `workers` processes (or on an already open pool) and stored in the cache.'''
+    tasks = list(tasks)
+    cache = open_cache(cache)
+    if cache is None:
+        keys = [None] * len(tasks)
+        reports = [None] * len(tasks)
+    else:
+        keys = [run_key(*task) for task in tasks]
+        reports = [cache.get(key) for key in keys]
+    missing = [i for i, report in enumerate(reports) if report is None]
+    if pool is not None:
+        computed = list(pool.map(_run_task, [tasks[i] for i in missing]))
+    else:
+        computed = map_tasks(_run_task, [tasks[i] for i in missing], workers)
+    for i, report in zip(missing, computed):
+        reports[i] = report
+        if cache is not None:
+            cache.put(keys[i], report)
+    return reports
+
+
+def fresh_seed(seed):
+    '''seed as a SeedSequence that hasn't spawned any children yet. spawn() counts the children
+    a SeedSequence has made, so spawning from the caller's own object would give different
+    children (and cache keys) every time it is passed in.'''
+    if not isinstance(seed, np.random.SeedSequence):
+        return np.random.SeedSequence(seed)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key, pool_size=seed.pool_size)
+
+
+def spawn_seeds(seed, num_replications: int):
+    '''num_replications independent child SeedSequences of seed, the same ones every time'''
+    return fresh_seed(seed).spawn(num_replications)
+
+
+class ReplicationResults:
+    '''Per-replication summaries plus their pooled means and confidence intervals.'''
+
+    def __init__(self, replications, confidence=0.95):
+        self.replications = replications
+        self.confidence = confidence
+        self.metrics = list(replications[0].keys()) if replications else []
+
+        # metric -> {"mean", "half_width", "low", "high", "n"}
+        self.pooled = {}
+        for metric in self.metrics:
+            values = self.values(metric)
+            mean, half_width = mean_confidence_interval(values, confidence)
+            self.pooled[metric] = {
+                "mean": mean,
+                "half_width": half_width,
+                "low": mean - half_width,
+                "high": mean + half_width,
+                "n": int(np.count_nonzero(~np.isnan(values))),
+            }
+
+    def values(self, metric):
+        return np.array([r[metric] for r in self.replications], dtype=float)
+
+    def mean(self, metric):
+        return self.pooled[metric]["mean"]
+
+    def confidence_interval(self, metric):
+        return self.pooled[metric]["low"], self.pooled[metric]["high"]
+
+    def __str__(self):
+        lines = ["{} replications, {:.0f}% confidence intervals:".format(len(self.replications), self.confidence * 100)]
+        for metric in self.metrics:
+            p = self.pooled[metric]
+            lines.append("{:<40} {:>12.4f} +/- {:.4f}".format(metric, p["mean"], p["half_width"]))
+        return "\n".join(lines)
+
+
+def run_replications(num_paintings: int, num_customers: int, num_replications: int = 5, seed=None,
+                     workers=None, confidence=0.95, cache=None, **sim_kwargs):
+    '''Run num_replications GallerySims with independent seeds spawned from seed,
+    over `workers` processes (all cores by default). Replications already in cache
+    (a ResultCache or its path) aren't run again. Extra keyword arguments go to GallerySim.'''
+    tasks = [(num_paintings, num_customers, child, sim_kwargs) for child in spawn_seeds(seed, num_replications)]
+    # without a seed the runs can't be repeated, so there's nothing worth caching
+    return ReplicationResults(run_cached(tasks, workers, cache if seed is not None else None), confidence)
+
+
+def _relative_half_width(pooled):
+    if pooled["n"] < 2 or np.isnan(pooled["half_width"]):
+        return np.inf
+    if pooled["mean"] == 0:
+        return 0.0 if pooled["half_width"] == 0 else np.inf
+    return pooled["half_width"] / abs(pooled["mean"])
+
+
+class SequentialResults(ReplicationResults):
+    '''ReplicationResults of a sequential run, plus for every target metric the number of
+    replications after which its relative half width first met the target (None if it never did).'''
+
+    def __init__(self, replications, confidence, metrics, relative_half_width):
+        super().__init__(replications, confidence)
+        self.targets = list(metrics)
+        self.relative_half_width = relative_half_width
+        self.replications_needed = {}
+        for metric in self.targets:
+            self.replications_needed[metric] = None
+            for n in range(2, len(replications) + 1):
+                pooled = ReplicationResults(replications[:n], confidence).pooled[metric]
+                if _relative_half_width(pooled) <= relative_half_width:
+                    self.replications_needed[metric] = n
+                    break
+
+    @property
+    def converged(self):
+        return all(_relative_half_width(self.pooled[m]) <= self.relative_half_width for m in self.targets)
+
+    def __str__(self):
+        lines = [super().__str__(), ""]
+        lines.append("Target: relative half width <= {:.1%} ({})".format(
+            self.relative_half_width, "met" if self.converged else "not met, replication budget used up"))
+        for metric in self.targets:
+            needed = self.replications_needed[metric]
+            lines.append("{:<40} {:>8.2%}  {}".format(metric, _relative_half_width(self.pooled[metric]),
+                                                     "needed {} replications".format(needed) if needed else "not reached"))
+        return "\n".join(lines)
+
+
+def run_until_precise(num_paintings: int, num_customers: int, metrics, relative_half_width: float = 0.05,
+                      min_replications: int = 5, max_replications: int = 100, seed=None, workers=None,
+                      confidence=0.95, cache=None, **sim_kwargs):
+    '''Keep running replications, `workers` at a time, until the confidence interval of every
+    metric in metrics (SimReport keys, e.g. "percent_leave_early") has a half width of at most
+    relative_half_width times its mean, or max_replications have run.
+    Replication i gets the same seed as in run_replications, so the results are reproducible
+    and only depend on the seed, not on the number of workers. Replications already in cache
+    (a ResultCache or its path) aren't run again.'''
+    metrics = list(metrics)
+    cache = open_cache(cache) if seed is not None else None
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # spawned from in batches below, so a copy that starts from the first child like spawn_seeds
+    seed = fresh_seed(seed)
+    replications = []
+
+    def precise_enough(n):
+        if n < min_replications:
+            return False
+        results = ReplicationResults(replications[:n], confidence)
+        return all(_relative_half_width(results.pooled[m]) <= relative_half_width for m in metrics)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while len(replications) < max_replications and not precise_enough(len(replications)):
+            # the first batch goes straight to min_replications, after that a batch fills the workers
+            batch = min(max(min_replications - len(replications), workers), max_replications - len(replications))
+            # spawn keeps count of the children it has made, so child i is always the same
+            tasks = [(num_paintings, num_customers, child, sim_kwargs) for child in seed.spawn(batch)]
+            replications.extend(run_cached(tasks, 1, cache, pool))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    # a batch can overshoot the first count that is precise enough by up to workers - 1, the
+    # extra replications are dropped so the results are the ones a single worker would give
+    for n in range(min_replications, len(replications)):
+        if precise_enough(n):
+            replications = replications[:n]
+            break
+    return SequentialResults(replications, confidence, metrics, relative_half_width)
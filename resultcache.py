@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+
+## Persistent cache of GallerySim results, so re-running a study only simulates the runs
+## whose inputs changed. A run is keyed by a hash of everything that decides its result:
+## num_paintings, num_customers, the seed, the SimConfig and the other GallerySim options,
+## and a fingerprint of the model's source files (editing the model invalidates every entry).
+## Entries live in one SQLite file; when it grows past max_bytes the least recently used
+## entries are evicted.
+
+# the modules a run's results depend on
+MODEL_FILES = ("main.py", "scoring.py", "selection.py", "variates.py", "eventlist.py", "splaytree.py", "streamstats.py",
+               "layout.py")
+
+# GallerySim options that can't change the results
+IGNORED_OPTIONS = ("DEBUG",)
+
+_fingerprint = None
+
+
+def model_fingerprint():
+    '''hash of the source of MODEL_FILES'''
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in MODEL_FILES:
+            digest.update(name.encode())
+            with open(os.path.join(here, name), "rb") as f:
+                digest.update(f.read())
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+
+def _seed_key(seed):
+    if isinstance(seed, np.random.SeedSequence):
+        return {"entropy": seed.entropy, "spawn_key": list(seed.spawn_key)}
+    return seed
+
+
+def _option_key(value):
+    if hasattr(value, "as_dict"):  # SimConfig, GalleryLayout
+        return value.as_dict()
+    return value
+
+
+def run_key(num_paintings: int, num_customers: int, seed, sim_kwargs=None):
+    '''cache key of one run, None if the run can't be cached (no seed, so it isn't reproducible)'''
+    if seed is None:
+        return None
+    options = {name: _option_key(value) for name, value in (sim_kwargs or {}).items() if name not in IGNORED_OPTIONS}
+    if "config" not in options:
+        import main
+        options["config"] = main.SimConfig().as_dict()
+    description = json.dumps({
+        "model": model_fingerprint(),
+        "num_paintings": num_paintings,
+        "num_customers": num_customers,
+        "seed": _seed_key(seed),
+        "options": options,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()
+
+
+class ResultCache:
+    '''SimReports stored in a SQLite file, at most max_bytes of them (None for no limit).
+    hits / misses / evictions count this object's lookups and evictions.'''
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.db.commit()
+
+    def get(self, key):
+        '''the SimReport stored under key, or None'''
+        row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone() if key else None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        return _decode(row[0])
+
+    def put(self, key, report):
+        if key is None:
+            return
+        value = _encode(report)
+        self.db.execute("INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                        (key, value, len(value), time.time()))
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        '''drop the least recently used entries until the cache fits in max_bytes'''
+        if self.max_bytes is None:
+            return
+        total = self.size
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+            if total <= self.max_bytes:
+                break
+            self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        self.db.commit()
+
+    @property
+    def size(self):
+        '''total bytes of the stored results'''
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+        self.db.execute("DELETE FROM results")
+        self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else float("nan"),
+            "evictions": self.evictions,
+            "entries": len(self),
+            "bytes": self.size,
+        }
+
+    def close(self):
+        self.db.close()
+
+    def __str__(self):
+        s = self.stats()
+        return "ResultCache {}: {} hits, {} misses ({:.0%} hit rate), {} evicted, {} entries, {:.1f} kB".format(
+            self.path, s["hits"], s["misses"], s["hit_rate"] if s["hits"] + s["misses"] else 0,
+            s["evictions"], s["entries"], s["bytes"] / 1024)
+
+
+def _encode(report):
+    return json.dumps({
+        "metrics": {metric: int(value) if isinstance(value, (int, np.integer)) else float(value)
+                    for metric, value in report.items()},
+        "painting_qualities": [float(q) for q in getattr(report, "painting_qualities", [])],
+        "num_customers_leave_early": [int(n) for n in getattr(report, "num_customers_leave_early", [])],
+        "painting_occupancy": list(getattr(report, "painting_occupancy", [])),
+        "painting_peak_occupancy": [int(n) for n in getattr(report, "painting_peak_occupancy", [])],
+        # json keys are strings, the thresholds are put back in _decode
+        "painting_time_over": [[threshold, list(values)] for threshold, values in getattr(report, "painting_time_over", {}).items()],
+    })
+
+
+def _decode(value):
+    import main
+    data = json.loads(value)
+    report = main.SimReport(data["metrics"])
+    # numpy floats, like a fresh report's, so both print the same
+    report.painting_qualities = [np.float64(q) for q in data["painting_qualities"]]
+    report.num_customers_leave_early = data["num_customers_leave_early"]
+    report.painting_occupancy = data.get("painting_occupancy", [])
+    report.painting_peak_occupancy = data.get("painting_peak_occupancy", [])
+    report.painting_time_over = {threshold: values for threshold, values in data.get("painting_time_over", [])}
+    return report
+
+
+def open_cache(cache):
+    '''a ResultCache from a ResultCache, a path or None'''
+    if cache is None or isinstance(cache, ResultCache):
+        return cache
+    return ResultCache(cache)
@@ -0,0 +1,50 @@
+import math
+import numpy as np
+
+
+## Array versions of Customer.calcQualityScore / calcViewerScore / calcStyleScore.
+## Every function works on whole arrays of paintings at once so ProcessMove can
+## score the full gallery with one numpy expression instead of one python call per painting.
+
+# Higher this is the lower the slope in the middle
+SLOPE_CONSTANT = 10
+## SHouldn't edit this, the midpoint of the inverse sigmoid is 0.5 at MIDPOINT_HEIGHT of 1. Instead adjust the QUALITY_CONSTANT
+## Like you can edit this but you shouldn't need to unless you're doing fancy stuff
+MIDPOINT_HEIGHT = 1
+
+
+def quality_score(quality, quality_constant=1):
+    '''Scalar quality score, bit-for-bit the same as Customer.calcQualityScore.
+    Used to precompute the (customer independent) quality part of each painting's score.'''
+    ## For quality we want to have low quality paintings be very undesirable and high quality very desirable but 25-75 should have less of an effect
+    ## We can do this by using an inverse sigmoid function
+    return np.clip((0.5 - math.log((1-quality)/(quality * MIDPOINT_HEIGHT))/SLOPE_CONSTANT) * quality_constant * 100, 0, 100)
+
+
+def quality_scores(quality, quality_constant=1):
+    '''Vectorised quality score. np.log can differ from math.log in the last bit,
+    so the simulation precomputes with quality_score() and this is for bulk/plotting use.'''
+    quality = np.asarray(quality, dtype=float)
+    with np.errstate(divide='ignore'):
+        retval = (0.5 - np.log((1-quality)/(quality * MIDPOINT_HEIGHT))/SLOPE_CONSTANT) * quality_constant * 100
+    return np.clip(retval, 0, 100)
+
+
+def viewer_scores(num_viewers, tolerance, patience_constant=1):
+    # same operation order as Customer.calcViewerScore so the results match exactly
+    return 1/(np.maximum(np.sqrt(num_viewers) * 1/tolerance, 1)) * patience_constant * 100
+
+
+def style_scores(style, favorite_style, style_constant=1):
+    return (style == favorite_style) * style_constant
+
+
+def score_paintings(quality_score, num_viewers, style, viewed, tolerance, favorite_style,
+                    patience_constant=1, style_constant=1):
+    '''Score every painting for one customer: quality + viewer + style, with
+    already viewed paintings set to -1 (same convention as Customer.scorePainting).
+
+    quality_score, num_viewers, style and viewed are arrays indexed by painting id.'''
+    scores = quality_score + viewer_scores(num_viewers, tolerance, patience_constant) + style_scores(style, favorite_style, style_constant)
+    scores[viewed] = -1
+    return scores
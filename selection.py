@@ -0,0 +1,94 @@
+import math
+from bisect import bisect_left
+
+
+class BestPaintingIndex:
+    '''Finds a customer's best unviewed painting without scoring the whole gallery.
+
+    A painting's score is quality_score + viewer score + style score. The quality
+    part never changes and the style part is the same for every painting of a style,
+    so each customer keeps the paintings they haven't viewed yet in one list per
+    style, sorted by quality score (highest first, then lowest id). The index also
+    counts how many paintings of each style have each viewer count. The viewer score
+    only goes down as num_viewers goes up, so nothing further down a style's list
+    can beat its quality + the viewer score of that style's least crowded painting
+    + the style score. Each list is scanned only until that bound drops below the
+    best score found, which is a handful of entries unless the best paintings are
+    all crowded. Removing a viewed painting is a bisect, so a move costs roughly
+    O(styles + log paintings) instead of O(paintings).
+
+    The choice is exactly the one np.argmax makes over the full score array,
+    including ties (lowest painting id wins). Keeping the index up to date costs more
+    than the vectorized scan saves up to about 1000 paintings, where the scan is the
+    faster choice.'''
+
+    def __init__(self, quality_score, style, num_viewers):
+        self.quality_score = [float(q) for q in quality_score]
+        self.style = [int(s) for s in style]
+        self.num_viewers = [int(n) for n in num_viewers]
+        self.styles = sorted(set(self.style))
+
+        # style -> {viewer count: number of paintings of that style with that many viewers}
+        self.viewer_counts = {s: {} for s in self.styles}
+        for id, n in enumerate(self.num_viewers):
+            counts = self.viewer_counts[self.style[id]]
+            counts[n] = counts.get(n, 0) + 1
+
+        # style -> painting ids of that style in (quality score desc, id asc) order
+        self.order = {s: [] for s in self.styles}
+        for key in sorted(self._key(i) for i in range(len(self.quality_score))):
+            self.order[self.style[key[1]]].append(key)
+
+        # customer id -> {style: that customer's unviewed paintings of the style, in self.order order}
+        self.unviewed = {}
+
+    def _key(self, id):
+        return (-self.quality_score[id], id)
+
+    def update(self, id: int, old_viewers: int, new_viewers: int):
+        '''painting id went from old_viewers to new_viewers'''
+        self.num_viewers[id] = new_viewers
+        counts = self.viewer_counts[self.style[id]]
+        counts[old_viewers] -= 1
+        if counts[old_viewers] == 0:
+            del counts[old_viewers]
+        counts[new_viewers] = counts.get(new_viewers, 0) + 1
+
+    def mark_viewed(self, customer_id: int, id: int):
+        unviewed = self._unviewed(customer_id)[self.style[id]]
+        del unviewed[bisect_left(unviewed, self._key(id))]
+
+    def forget(self, customer_id: int):
+        '''drop a customer that has left the gallery'''
+        self.unviewed.pop(customer_id, None)
+
+    def _unviewed(self, customer_id):
+        unviewed = self.unviewed.get(customer_id)
+        if unviewed is None:
+            unviewed = self.unviewed[customer_id] = {s: list(order) for s, order in self.order.items()}
+        return unviewed
+
+    def best(self, customer_id: int, tolerance, favorite_style, patience_constant=1, style_constant=1):
+        '''return (painting id, score) of the customer's best unviewed painting, or
+        (-1, -1) if they have viewed every painting (the same -1s the layout path reports)'''
+        unviewed = self._unviewed(customer_id)
+        num_viewers = self.num_viewers
+
+        best_id = -1
+        best_score = -1
+        # the favourite style first, it usually sets a best score the other styles can't reach
+        for style in sorted(self.styles, key=lambda s: s != favorite_style):
+            style_score = (style == favorite_style) * style_constant
+            # highest viewer score any painting of this style can currently get
+            bound_viewer_score = 1/(max(math.sqrt(min(self.viewer_counts[style])) * 1/tolerance, 1)) * patience_constant * 100
+            for neg_quality, id in unviewed[style]:
+                quality_score = -neg_quality
+                # the list is sorted by quality so nothing from here on can beat this
+                if (quality_score + bound_viewer_score) + style_score < best_score:
+                    break
+                viewer_score = 1/(max(math.sqrt(num_viewers[id]) * 1/tolerance, 1)) * patience_constant * 100
+                score = (quality_score + viewer_score) + style_score
+                if score > best_score or (score == best_score and best_id != -1 and id < best_id):
+                    best_id = id
+                    best_score = score
+        return best_id, best_score
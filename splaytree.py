@@ -1,21 +1,51 @@
 #  https://github.com/anoopj/pysplay
+#  reworked for the event list: __slots__ nodes recycled from a free list, pop_min,
+#  insert_many and an optional key function (so keys can be plain tuples that compare
+#  in C instead of going through python-level __lt__/__eq__ methods)
 
 class Node:
-    def __init__(self, key):
+    __slots__ = ("key", "item", "left", "right")
+
+    def __init__(self, key, item=None):
         self.key = key
+        self.item = item
         self.left = self.right = None
 
     def equals(self, node):
         return self.key == node.key
 
 class SplayTree:
-    def __init__(self):
+    '''Top-down splay tree. Items are ordered by key(item), or by the items themselves
+    when no key function is given. Items whose key is already in the tree are ignored.'''
+
+    def __init__(self, key=None):
         self.root = None
         self.header = Node(None) #For splay()
+        self.keyfunc = key
+        self.size = 0
+        # nodes of removed items, reused by insert() instead of allocating new ones
+        self.free = []
+
+    def _node(self, key, item):
+        if self.free:
+            n = self.free.pop()
+            n.key = key
+            n.item = item
+            return n
+        return Node(key, item)
 
-    def insert(self, key):
+    def _release(self, n):
+        n.key = n.item = n.left = n.right = None
+        self.free.append(n)
+
+    def _key(self, item):
+        return item if self.keyfunc is None else self.keyfunc(item)
+
+    def insert(self, item):
+        key = self._key(item)
         if (self.root == None):
-            self.root = Node(key)
+            self.root = self._node(key, item)
+            self.size += 1
             return
 
         self.splay(key)
@@ -23,7 +53,7 @@ class SplayTree:
             # If the key is already there in the tree, don't do anything.
             return
 
-        n = Node(key)
+        n = self._node(key, item)
         if key < self.root.key:
             n.left = self.root.left
             n.right = self.root
@@ -33,31 +63,69 @@ class SplayTree:
             n.left = self.root
             self.root.right = None
         self.root = n
+        self.size += 1
+
+    def items(self):
+        '''every item, smallest key first'''
+        stack, n = [], self.root
+        while stack or n is not None:
+            while n is not None:
+                stack.append(n)
+                n = n.left
+            n = stack.pop()
+            yield n.item
+            n = n.right
 
-    def remove(self, key):
+    # pickled as the sorted items, the nodes nest too deep for pickle once the tree gets big
+    def __getstate__(self):
+        return {"keyfunc": self.keyfunc, "items": list(self.items())}
+
+    def __setstate__(self, state):
+        self.__init__(state["keyfunc"])
+        self.insert_many(state["items"])
+
+    def insert_many(self, items):
+        for item in items:
+            self.insert(item)
+
+    def remove(self, item):
+        key = self._key(item)
+        if self.root == None:
+            raise KeyError('key not found in tree')
         self.splay(key)
         if key != self.root.key:
-            raise 'key not found in tree'
+            raise KeyError('key not found in tree')
 
         # Now delete the root.
+        old = self.root
         if self.root.left== None:
-            #print("deleting root")
             self.root = self.root.right
         else:
-            #print("other one")
             x = self.root.right
             self.root = self.root.left
             self.splay(key)
             self.root.right = x
+        self._release(old)
+        self.size -= 1
+
+    def pop_min(self):
+        '''remove and return the smallest item in a single splay'''
+        if self.root == None:
+            raise KeyError('pop from empty tree')
+        self.splay_min()
+        # the minimum is now the root and has no left child
+        old = self.root
+        item = old.item
+        self.root = old.right
+        self._release(old)
+        self.size -= 1
+        return item
 
     def findMin(self):
         if self.root == None:
             return None
-        x = self.root
-        while x.left != None:
-            x = x.left
-        self.splay(x.key)
-        return x.key
+        self.splay_min()
+        return self.root.item
 
     def findMax(self):
         if self.root == None:
@@ -66,19 +134,42 @@ class SplayTree:
         while (x.right != None):
             x = x.right
         self.splay(x.key)
-        return x.key
+        return x.item
 
-    def find(self, key):
+    def find(self, item):
         if self.root == None:
             return None
+        key = self._key(item)
         self.splay(key)
         if self.root.key != key:
             return None
-        return self.root.key
+        return self.root.item
 
     def isEmpty(self):
         return self.root == None
-    
+
+    def __len__(self):
+        return self.size
+
+    def splay_min(self):
+        # top-down splay towards the leftmost node (splay() with a key smaller than everything)
+        r = self.header
+        t = self.root
+        self.header.left = None
+        while t.left != None:
+            y = t.left
+            t.left = y.right
+            y.right = t
+            t = y
+            if t.left == None:
+                break
+            r.left = t
+            r = t
+            t = t.left
+        r.left = t.right
+        t.right = self.header.left
+        self.root = t
+
     def splay(self, key):
         l = r = self.header
         t = self.root
@@ -0,0 +1,165 @@
+import math
+
+import numpy as np
+
+from confidence import mean_confidence_interval
+
+
+## Steady-state output analysis of one long run. The sim runs to a time horizon with
+## customers arriving the whole time, every departing customer is one observation (in order
+## of departure), the warm-up at the start of each output series is cut off where MSER-5
+## puts it and the rest is split into batches whose means give the confidence interval.
+
+# name -> the per-customer observation it is the mean of
+METRICS = {
+    "time_in_gallery": "departure_time - arrival_time",
+    "num_paintings_viewed": "paintings viewed",
+    "total_viewing_time": "time spent viewing",
+    "average_score": "mean score of the paintings viewed (customers who viewed none left out)",
+    "percent_leave_early": "100 if the customer left before seeing every painting, else 0",
+    "percent_saw_favorite_style": "100 if the customer saw a painting of their favorite style, else 0",
+}
+
+
+class DepartureSeries:
+    '''Per-customer observations of a run in order of departure, a GallerySim writer
+    (GallerySim(writer=...)) that keeps them in memory instead of writing them out.'''
+
+    def __init__(self, initial_size: int = 1 << 12):
+        self.count = 0
+        self.departure_time = np.zeros(initial_size)
+        self.columns = {name: np.zeros(initial_size) for name in METRICS}
+        self.closed = False
+
+    def add_customer(self, customers, id: int):
+        if self.count == len(self.departure_time):
+            self.departure_time = np.resize(self.departure_time, 2 * self.count)
+            self.columns = {name: np.resize(column, 2 * self.count) for name, column in self.columns.items()}
+        i = self.count
+        num_viewed = int(customers.num_paintings_viewed[id])
+        columns = self.columns
+        self.departure_time[i] = customers.departure_time[id]
+        columns["time_in_gallery"][i] = customers.departure_time[id] - customers.arrival_time[id]
+        columns["num_paintings_viewed"][i] = num_viewed
+        columns["total_viewing_time"][i] = customers.total_viewing_time[id]
+        columns["average_score"][i] = customers.score_total[id] / num_viewed if num_viewed > 0 else np.nan
+        columns["percent_leave_early"][i] = 100.0 if num_viewed < customers.num_paintings else 0.0
+        columns["percent_saw_favorite_style"][i] = 100.0 if customers.saw_favorite_style[id] else 0.0
+        self.count += 1
+
+    def write_paintings(self, paintings, views):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def __len__(self):
+        return self.count
+
+    def series(self, metric: str):
+        '''(departure times, observations) of metric, observations without data left out'''
+        values = self.columns[metric][:self.count]
+        keep = ~np.isnan(values)
+        return self.departure_time[:self.count][keep], values[keep]
+
+
+def mser_truncation(values, batch_size: int = 5):
+    '''MSER-5 (MSER-m with m = batch_size): the number of observations at the start of
+    values to drop as warm-up. The observations are averaged in batches of batch_size and the
+    truncation point d (in batches, at most half of them) minimizes the marginal standard
+    error sum((y_i - mean(y[d:]))^2 for i >= d) / (n - d)^2 of the batch means y.
+    Returns (observations to drop, whether the minimum was at the half way limit, which
+    means the run is too short for the warm-up to have finished).'''
+    values = np.asarray(values, dtype=float)
+    num_batches = len(values) // batch_size
+    if num_batches < 2:
+        return 0, False
+    y = values[:num_batches * batch_size].reshape(num_batches, batch_size).mean(axis=1)
+    y = y - y.mean()  # centred, so the sums of squares below don't lose precision
+    # sums over y[d:] for every d
+    suffix_sum = np.cumsum(y[::-1])[::-1]
+    suffix_squares = np.cumsum((y * y)[::-1])[::-1]
+    remaining = np.arange(num_batches, 0, -1, dtype=float)
+    mser = (suffix_squares - suffix_sum * suffix_sum / remaining) / (remaining * remaining)
+    limit = num_batches // 2
+    d = int(np.argmin(mser[:limit + 1]))
+    return d * batch_size, d == limit
+
+
+def batch_means(values, num_batches: int = 20, confidence: float = 0.95):
+    '''(mean, half width, batch size, lag 1 autocorrelation of the batch means) of the
+    batch means confidence interval of values. Any observations left over after
+    num_batches equal batches are taken from the start of values. A lag 1 autocorrelation
+    well above 0 means the batches are too short to be treated as independent.'''
+    values = np.asarray(values, dtype=float)
+    batch_size = len(values) // num_batches
+    if batch_size == 0:
+        return math.nan, math.nan, 0, math.nan
+    y = values[len(values) - num_batches * batch_size:].reshape(num_batches, batch_size).mean(axis=1)
+    mean, half_width = mean_confidence_interval(y, confidence)
+    centred = y - y.mean()
+    denominator = float(np.dot(centred, centred))
+    lag1 = float(np.dot(centred[:-1], centred[1:]) / denominator) if denominator > 0 else math.nan
+    return mean, half_width, batch_size, lag1
+
+
+class SteadyStateResults:
+    '''Steady-state estimates of one run to horizon: for every metric the warm-up cut off by
+    MSER-5 and the batch means mean and confidence interval of what is left.'''
+
+    def __init__(self, series: DepartureSeries, horizon: float, num_batches: int = 20, confidence: float = 0.95,
+                 metrics=None):
+        self.series = series
+        self.horizon = horizon
+        self.num_batches = num_batches
+        self.confidence = confidence
+        self.metrics = list(metrics) if metrics is not None else list(METRICS)
+        # metric -> {"mean", "half_width", "low", "high", "warmup", "warmup_time", "warmup_at_limit", "n", "batch_size", "lag1"}
+        self.estimates = {}
+        for metric in self.metrics:
+            times, values = series.series(metric)
+            warmup, at_limit = mser_truncation(values)
+            mean, half_width, batch_size, lag1 = batch_means(values[warmup:], num_batches, confidence)
+            self.estimates[metric] = {
+                "mean": mean,
+                "half_width": half_width,
+                "low": mean - half_width,
+                "high": mean + half_width,
+                "warmup": warmup,
+                "warmup_time": float(times[warmup - 1]) if warmup > 0 else 0.0,
+                "warmup_at_limit": at_limit,
+                "n": len(values) - warmup,
+                "batch_size": batch_size,
+                "lag1": lag1,
+            }
+
+    def mean(self, metric):
+        return self.estimates[metric]["mean"]
+
+    def confidence_interval(self, metric):
+        return self.estimates[metric]["low"], self.estimates[metric]["high"]
+
+    def __str__(self):
+        lines = ["Steady state to time {:g}: {} departures, {} batch means, {:.0f}% confidence intervals:".format(
+            self.horizon, len(self.series), self.num_batches, self.confidence * 100)]
+        lines.append("{:<28} {:>12} {:>10} {:>8} {:>10} {:>6} {:>6}".format(
+            "metric", "mean", "+/-", "warm-up", "until", "batch", "lag1"))
+        for metric in self.metrics:
+            e = self.estimates[metric]
+            lines.append("{:<28} {:>12.4f} {:>10.4f} {:>8} {:>10.1f} {:>6} {:>6.2f}{}".format(
+                metric, e["mean"], e["half_width"], e["warmup"], e["warmup_time"], e["batch_size"], e["lag1"],
+                "  (warm-up at the limit, run longer)" if e["warmup_at_limit"] else ""))
+        return "\n".join(lines)
+
+
+def run_steady_state(num_paintings: int, horizon: float, seed=None, num_batches: int = 20, confidence: float = 0.95,
+                     metrics=None, **sim_kwargs):
+    '''Simulate one GallerySim with customers arriving until time horizon and return the
+    SteadyStateResults of the customers that departed by then. Extra keyword arguments go
+    to GallerySim (not writer, the run's writer collects the observations).'''
+    import main  # imported lazily, like replications does
+    series = DepartureSeries()
+    sim = main.GallerySim(num_paintings, None, seed, writer=series, **sim_kwargs)
+    sim.run_until(horizon)
+    sim.close_outputs()
+    return SteadyStateResults(series, horizon, num_batches, confidence, metrics)
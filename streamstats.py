@@ -0,0 +1,281 @@
+import math
+import numpy as np
+
+
+## O(1) memory accumulators for statistics that used to be kept as ever growing lists
+## (SimStats.painting_scores, leave_early_scores, customer score histories).
+## Both accumulators take single values (add) or whole numpy arrays (add_many) and
+## can be merged, e.g. to pool replications.
+
+class RunningStats:
+    '''count, mean, variance, min and max of a stream of values.
+    Batches are combined with Chan et al.'s parallel update so add_many is one numpy pass.'''
+
+    __slots__ = ("count", "total", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x):
+        x = float(x)
+        if self.count > 0:
+            delta = x - self.total / self.count
+            self.m2 += delta * delta * self.count / (self.count + 1)
+        self.count += 1
+        self.total += x
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        batch = RunningStats()
+        batch.count = len(values)
+        batch.total = float(np.sum(values))
+        batch.m2 = float(np.sum((values - batch.total / batch.count) ** 2))
+        batch.min = float(np.min(values))
+        batch.max = float(np.max(values))
+        self.merge(batch)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        if self.count > 0:
+            delta = other.total / other.count - self.total / self.count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / (self.count + other.count)
+        else:
+            self.m2 = other.m2
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count > 0 else math.nan
+
+    @property
+    def variance(self):
+        # sample variance
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def __len__(self):
+        return self.count
+
+
+class QuantileSketch:
+    '''Streaming quantiles with a relative error guarantee (DDSketch, Masson et al. 2019).
+
+    Values are counted in logarithmic buckets: bucket k holds values in (gamma^(k-1), gamma^k]
+    with gamma = (1 + a) / (1 - a), so any quantile comes back within relative error a of
+    the true value. Memory only grows with log(max / min), not with the number of values.
+    Zeros and negative values are kept in their own zero count and mirrored store.'''
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.zero_count = 0
+        # bucket counts as numpy arrays starting at bucket offset
+        self.positive = np.zeros(0, dtype=np.int64)
+        self.positive_offset = 0
+        self.negative = np.zeros(0, dtype=np.int64)
+        self.negative_offset = 0
+
+    def add(self, x):
+        self.add_many(np.array([x], dtype=float))
+
+    def add_many(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        positive = values[values > 0]
+        negative = -values[values < 0]
+        self.zero_count += len(values) - len(positive) - len(negative)
+        if len(positive):
+            self.positive, self.positive_offset = self._add_to_store(self.positive, self.positive_offset, positive)
+        if len(negative):
+            self.negative, self.negative_offset = self._add_to_store(self.negative, self.negative_offset, negative)
+
+    def _add_to_store(self, store, offset, values):
+        keys = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        store, offset = self._grow(store, offset, int(keys.min()), int(keys.max()))
+        store += np.bincount(keys - offset, minlength=len(store))
+        return store, offset
+
+    @staticmethod
+    def _grow(store, offset, low, high):
+        '''store widened (if needed) to cover buckets low..high'''
+        if len(store) == 0:
+            return np.zeros(high - low + 1, dtype=np.int64), low
+        if low >= offset and high < offset + len(store):
+            return store, offset
+        new_offset = min(low, offset)
+        grown = np.zeros(max(high, offset + len(store) - 1) - new_offset + 1, dtype=np.int64)
+        grown[offset - new_offset:offset - new_offset + len(store)] = store
+        return grown, new_offset
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("can only merge sketches with the same relative accuracy")
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for name in ("positive", "negative"):
+            other_store, other_offset = getattr(other, name), getattr(other, name + "_offset")
+            if len(other_store) == 0:
+                continue
+            store, offset = self._grow(getattr(self, name), getattr(self, name + "_offset"),
+                                       other_offset, other_offset + len(other_store) - 1)
+            store[other_offset - offset:other_offset - offset + len(other_store)] += other_store
+            setattr(self, name, store)
+            setattr(self, name + "_offset", offset)
+
+    def _value(self, key):
+        # midpoint (in relative terms) of bucket key
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q: float):
+        '''value at quantile q (0 <= q <= 1), nan if nothing was added'''
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        # negative values, largest magnitude first
+        negative_total = int(self.negative.sum())
+        if rank < negative_total:
+            cumulative = np.cumsum(self.negative[::-1])
+            i = int(np.searchsorted(cumulative, rank, side="right"))
+            return -self._value(self.negative_offset + len(self.negative) - 1 - i)
+        rank -= negative_total
+        if rank < self.zero_count:
+            return 0.0
+        rank -= self.zero_count
+        cumulative = np.cumsum(self.positive)
+        i = min(int(np.searchsorted(cumulative, rank, side="right")), len(self.positive) - 1)
+        return self._value(self.positive_offset + i)
+
+    def __len__(self):
+        return self.count
+
+
+class BatchBuffer:
+    '''Collects the values of many small add_many calls in a preallocated array and passes
+    them on to the accumulators in large blocks, so the per-call numpy overhead of the
+    accumulators is paid once per block instead of once per call. Call flush() before
+    reading the accumulators.'''
+
+    def __init__(self, *accumulators, size: int = 1 << 16):
+        self.accumulators = accumulators
+        self.buffer = np.empty(size)
+        self.filled = 0
+
+    def add_many(self, values):
+        n = len(values)
+        if self.filled + n > len(self.buffer):
+            self.flush()
+            if n > len(self.buffer):
+                for accumulator in self.accumulators:
+                    accumulator.add_many(values)
+                return
+        self.buffer[self.filled:self.filled + n] = values
+        self.filled += n
+
+    def flush(self):
+        if self.filled:
+            for accumulator in self.accumulators:
+                accumulator.add_many(self.buffer[:self.filled])
+            self.filled = 0
+
+
+class OccupancyStats:
+    '''Time-weighted statistics of a set of counters that go up and down over time (the number
+    of viewers of each painting): per counter the time average, the peak and the time spent
+    above each of thresholds. change() is O(1) and has to be called whenever a counter changes.
+    Every snapshot_interval units of time (if given) a copy of all the counters goes into a
+    ring buffer holding the snapshot_capacity latest snapshots, for plotting.
+    counts is the array of live counters, only read for the snapshots and the summaries.'''
+
+    def __init__(self, counts, thresholds=(), snapshot_interval: float = None, snapshot_capacity: int = 1024):
+        n = len(counts)
+        self.counts = counts
+        self.thresholds = tuple(thresholds)
+        # python lists, a scalar update is much quicker on a list than on an ndarray
+        self.area = [0.0] * n  # integral of each counter over time
+        self.last_change = [0.0] * n
+        self.peak = [0] * n
+        self.time_above = [[0.0] * n for threshold in self.thresholds]
+        self.time = 0.0  # of the latest change
+
+        self.snapshot_interval = snapshot_interval
+        self.next_snapshot = 0.0 if snapshot_interval else math.inf
+        self.snapshot_times = np.zeros(snapshot_capacity if snapshot_interval else 0)
+        self.snapshot_counts = np.zeros((len(self.snapshot_times), n), dtype=np.asarray(counts).dtype)
+        self.num_snapshots = 0
+
+    def change(self, id: int, old: int, new: int, time: float):
+        '''counter id goes from old to new at time'''
+        if time >= self.next_snapshot:
+            self._snapshot(time)
+        dt = time - self.last_change[id]
+        if dt > 0:
+            self.area[id] += old * dt
+            for above, threshold in zip(self.time_above, self.thresholds):
+                if old > threshold:
+                    above[id] += dt
+        self.last_change[id] = time
+        if new > self.peak[id]:
+            self.peak[id] = new
+        self.time = time
+
+    def _snapshot(self, time):
+        # the counters haven't changed yet, so they are what they were at every snapshot time up to now
+        while self.next_snapshot <= time:
+            slot = self.num_snapshots % len(self.snapshot_times)
+            self.snapshot_times[slot] = self.next_snapshot
+            self.snapshot_counts[slot] = self.counts
+            self.num_snapshots += 1
+            self.next_snapshot += self.snapshot_interval
+
+    def _since_last_change(self, time):
+        if time is None:
+            time = self.time
+        return time, np.maximum(time - np.array(self.last_change), 0.0)
+
+    def mean(self, time: float = None):
+        '''time average of every counter from time 0 to time (the latest change by default)'''
+        time, dt = self._since_last_change(time)
+        if time <= 0:
+            return np.zeros(len(self.area))
+        return (np.array(self.area) + np.asarray(self.counts) * dt) / time
+
+    def fraction_above(self, threshold, time: float = None):
+        '''fraction of the time from 0 to time every counter was above threshold (one of thresholds)'''
+        time, dt = self._since_last_change(time)
+        if time <= 0:
+            return np.zeros(len(self.area))
+        above = np.array(self.time_above[self.thresholds.index(threshold)])
+        return (above + (np.asarray(self.counts) > threshold) * dt) / time
+
+    def peaks(self):
+        return np.array(self.peak)
+
+    def snapshots(self):
+        '''(times, counts) of the snapshots still in the ring buffer, oldest first: counts[i]
+        is a copy of all the counters at times[i]'''
+        capacity = len(self.snapshot_times)
+        if self.num_snapshots <= capacity:
+            return self.snapshot_times[:self.num_snapshots].copy(), self.snapshot_counts[:self.num_snapshots].copy()
+        order = (np.arange(capacity) + self.num_snapshots) % capacity
+        return self.snapshot_times[order], self.snapshot_counts[order]
@@ -0,0 +1,137 @@
+import csv
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from replications import run_replication, spawn_seeds
+from resultcache import open_cache, run_key
+
+
+## Parameter sweeps: a design is a list of points, each a dict of SimConfig fields
+## (see main.SimConfig) plus optionally num_paintings / num_customers. Every (point,
+## replication) pair is one task; tasks go to a process pool biggest first so a few long
+## runs don't end up alone at the end, and the results come back as one table with a row
+## per task. Replication r of every point uses the same seed (common random numbers across
+## the design), so differences between points aren't swamped by seed noise.
+
+SIZE_FIELDS = ("num_paintings", "num_customers")
+
+
+def grid(**axes):
+    '''every combination of the values of the axes, e.g. grid(min_score=[110, 130], quality_mean=[0.4, 0.5])'''
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+def latin_hypercube(num_points: int, seed=None, **ranges):
+    '''num_points points of a Latin hypercube design over ranges, e.g.
+    latin_hypercube(100, min_score=(100, 150), viewing_time_mean=(2, 4)).
+    Each range is cut into num_points equal strata and every stratum of every axis is used
+    exactly once. Integer ranges (num_paintings, num_customers) give integer values.'''
+    rng = np.random.default_rng(seed)
+    points = [{} for i in range(num_points)]
+    for name, (low, high) in ranges.items():
+        # one uniform value in each stratum, strata shuffled independently per axis
+        u = (rng.permutation(num_points) + rng.random(num_points)) / num_points
+        values = low + u * (high - low)
+        if name in SIZE_FIELDS:
+            values = np.floor(values).astype(int)
+        for point, value in zip(points, values.tolist()):
+            point[name] = value
+    return points
+
+
+def _task_cost(task):
+    # every move scores every painting, so a run costs about customers * paintings
+    return task[1] * task[2]
+
+
+def _run_task(task):
+    index, num_paintings, num_customers, seed, sim_kwargs = task
+    return index, run_replication(num_paintings, num_customers, seed, sim_kwargs)
+
+
+class SweepResults:
+    '''One row per (point, replication): the point's index, the replication number, the full
+    configuration and every SimReport metric.'''
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.columns = list(rows[0].keys()) if rows else []
+
+    def column(self, name):
+        return np.array([row[name] for row in self.rows])
+
+    def to_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def run_sweep(points, num_paintings: int = 50, num_customers: int = 1000, replications: int = 1, seed=None,
+              workers=None, base_config=None, output=None, cache=None, **sim_kwargs):
+    '''Run every point of a design (e.g. from grid or latin_hypercube) `replications` times
+    over `workers` processes (all cores by default) and return a SweepResults table, also
+    written to the csv file output if given. Fields a point doesn't set come from base_config
+    (a main.SimConfig, the defaults if None) and num_paintings / num_customers.
+    Runs already in cache (a ResultCache or its path) aren't run again, so changing one
+    corner of a design only reruns that corner. Extra keyword arguments go to GallerySim.'''
+    import main
+    base_config = base_config if base_config is not None else main.SimConfig()
+    seeds = spawn_seeds(seed, replications)
+
+    tasks = []
+    configs = []
+    for i, point in enumerate(points):
+        point = dict(point)
+        paintings = int(point.pop("num_paintings", num_paintings))
+        customers = int(point.pop("num_customers", num_customers))
+        config = base_config.replace(**point)
+        configs.append((paintings, customers, config))
+        for r in range(replications):
+            tasks.append((len(tasks), paintings, customers, seeds[r], dict(sim_kwargs, config=config)))
+
+    reports = [None] * len(tasks)
+    cache = open_cache(cache) if seed is not None else None
+    keys = [None] * len(tasks)
+    if cache is not None:
+        keys = [run_key(*task[1:]) for task in tasks]
+        reports = [cache.get(key) for key in keys]
+    order = sorted((task for task in tasks if reports[task[0]] is None), key=_task_cost, reverse=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(order))
+    if workers <= 1:
+        for task in order:
+            index, report = _run_task(task)
+            reports[index] = report
+            if cache is not None:
+                cache.put(keys[index], report)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # submitted biggest first, the pool hands them out in that order
+            for future in as_completed([pool.submit(_run_task, task) for task in order]):
+                index, report = future.result()
+                reports[index] = report
+                if cache is not None:
+                    cache.put(keys[index], report)
+
+    rows = []
+    for i, (paintings, customers, config) in enumerate(configs):
+        for r in range(replications):
+            report = reports[i * replications + r]
+            row = {"point": i, "replication": r, "num_paintings": paintings, "num_customers": customers}
+            row.update(config.as_dict())
+            row.update((metric, float(value)) for metric, value in report.items()
+                       if metric not in ("num_paintings", "num_customers"))
+            rows.append(row)
+    results = SweepResults(rows)
+    if output is not None:
+        results.to_csv(output)
+    return results
@@ -0,0 +1,216 @@
+import json
+
+import numpy as np
+
+from streamstats import OccupancyStats
+
+
+## Structured event tracing. A tracer passed to GallerySim(tracer=...) gets one fixed-size
+## record per arrival, view and departure; with no tracer the sim only pays one `is not None`
+## test at each of those points. TraceWriter keeps the records in a preallocated memory-mapped
+## file (growing it as needed, or as a ring that keeps only the last `capacity` records), with
+## the run's description (sizes, the paintings) next to it in <path>.json. read_trace / replay
+## read it back and rebuild_stats recomputes the run's SimStats from it.
+
+# record kinds, the same numbers as main.EventType
+ARRIVAL = 0
+DEPARTURE = 1
+MOVE = 2  # the customer starts viewing a painting
+KIND_NAMES = {ARRIVAL: "ARRIVAL", DEPARTURE: "DEPARTURE", MOVE: "MOVE"}
+
+# painting: the painting viewed (MOVE) or the best one left when leaving (DEPARTURE), -1 on ARRIVAL
+# score: that painting's score
+# value: viewing time (MOVE), tolerance (ARRIVAL), number of paintings viewed (DEPARTURE)
+# style: the painting's style (MOVE), the customer's favourite style (ARRIVAL), -1 on DEPARTURE
+TRACE_DTYPE = np.dtype([
+    ("time", np.float64),
+    ("kind", np.int8),
+    ("style", np.int8),
+    ("painting", np.int32),
+    ("customer", np.int64),
+    ("score", np.float64),
+    ("value", np.float64),
+])
+
+
+class TraceWriter:
+    '''Writes trace records to a memory-mapped file at path. Records are collected in a
+    list and copied to the map chunk_size at a time. With ring=True only the last capacity
+    records are kept, otherwise the file grows (doubling) when it fills up.'''
+
+    def __init__(self, path: str, capacity: int = 1 << 20, ring: bool = False, chunk_size: int = 1 << 14):
+        self.path = path
+        self.capacity = capacity
+        self.ring = ring
+        self.chunk_size = chunk_size
+        self.count = 0  # records written, including ones a ring has overwritten
+        self.pending = []
+        self.meta = {}
+        self.map = np.memmap(path, dtype=TRACE_DTYPE, mode="w+", shape=(capacity,))
+        self.closed = False
+
+    def start(self, sim):
+        '''record the description of the run, called by GallerySim'''
+        self.meta = {
+            "num_paintings": sim.num_paintings,
+            "num_customers": sim.num_customers,
+            "min_score": sim.config.min_score,
+            "occupancy": sim.stats.occupancy is not None,
+            "occupancy_thresholds": list(sim.occupancy_thresholds),
+            "painting_style": sim.paintings.style.tolist(),
+            "painting_quality": sim.paintings.quality.tolist(),
+        }
+
+    def record(self, time, kind, customer, painting, score, value, style):
+        self.pending.append((time, kind, style, painting, customer, score, value))
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        chunk = np.array(self.pending, dtype=TRACE_DTYPE)
+        self.pending = []
+        if self.ring:
+            # a chunk larger than the ring only keeps its tail
+            chunk = chunk[-self.capacity:]
+            start = self.count % self.capacity
+            first = min(len(chunk), self.capacity - start)
+            self.map[start:start + first] = chunk[:first]
+            self.map[:len(chunk) - first] = chunk[first:]
+        else:
+            if self.count + len(chunk) > self.capacity:
+                self._grow(max(2 * self.capacity, self.count + len(chunk)))
+            self.map[self.count:self.count + len(chunk)] = chunk
+        self.count += len(chunk)
+
+    def _grow(self, capacity):
+        self.map.flush()
+        del self.map
+        with open(self.path, "r+b") as f:
+            f.truncate(capacity * TRACE_DTYPE.itemsize)
+        self.capacity = capacity
+        self.map = np.memmap(self.path, dtype=TRACE_DTYPE, mode="r+", shape=(capacity,))
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.map.flush()
+        self.closed = True
+        meta = dict(self.meta, count=self.count, capacity=self.capacity, ring=self.ring)
+        with open(self.path + ".json", "w") as f:
+            json.dump(meta, f)
+
+
+class PrintTracer:
+    '''Prints every record, what GallerySim(DEBUG=True) uses.'''
+
+    closed = False
+
+    def start(self, sim):
+        pass
+
+    def record(self, time, kind, customer, painting, score, value, style):
+        if kind == ARRIVAL:
+            print("Time: {} ARRIVAL customer {} favourite style {} tolerance {}".format(time, customer, style, value))
+        elif kind == MOVE:
+            print("Time: {} MOVE customer {} to painting {} (style {}) score {} viewing for {}".format(
+                time, customer, painting, style, score, value))
+        else:
+            print("Time: {} DEPARTURE customer {} after {} paintings, best score left {}".format(
+                time, customer, int(value), score))
+
+    def close(self):
+        pass
+
+
+def read_meta(path: str):
+    with open(path + ".json") as f:
+        return json.load(f)
+
+
+def read_trace(path: str):
+    '''the records of a trace in the order they were written (for a ring, the ones it kept)'''
+    meta = read_meta(path)
+    count, capacity = meta["count"], meta["capacity"]
+    records = np.memmap(path, dtype=TRACE_DTYPE, mode="r", shape=(capacity,)) if capacity else np.zeros(0, TRACE_DTYPE)
+    if meta["ring"] and count > capacity:
+        start = count % capacity
+        return np.concatenate([records[start:], records[:start]])
+    return records[:count]
+
+
+def replay(path: str):
+    '''yields (time, kind name, customer, painting, score, value, style) for every record'''
+    for r in read_trace(path):
+        yield (float(r["time"]), KIND_NAMES[int(r["kind"])], int(r["customer"]), int(r["painting"]),
+               float(r["score"]), float(r["value"]), int(r["style"]))
+
+
+def rebuild_stats(path: str, occupancy: bool = None):
+    '''(SimStats, CustomerTable, PaintingTable) of the traced run, rebuilt from its records, so
+    stats.report(customers, paintings) gives the run's report. The scores of the paintings a
+    customer didn't choose aren't traced, so the painting score statistics stay empty (like
+    a run with selection="index"). The occupancy statistics are rebuilt if the run kept them,
+    or with occupancy=True even if it didn't (with its occupancy_thresholds). A ring that has
+    wrapped around can't be rebuilt.'''
+    import main
+    meta = read_meta(path)
+    if meta["ring"] and meta["count"] > meta["capacity"]:
+        raise ValueError("{} is a ring trace that has overwritten its oldest records".format(path))
+    num_paintings, num_customers = meta["num_paintings"], meta["num_customers"]
+    paintings = main.PaintingTable(meta["painting_style"], meta["painting_quality"])
+    customers = main.CustomerTable(num_customers, num_paintings)
+    stats = main.SimStats(num_customers, num_paintings)
+    # the viewers of each painting follow from the moves, so the occupancy statistics can be rebuilt too
+    if occupancy is None:
+        occupancy = meta.get("occupancy", True)
+    if occupancy:
+        stats.occupancy = paintings.occupancy = OccupancyStats(
+            paintings.num_viewers, meta.get("occupancy_thresholds", main.OCCUPANCY_THRESHOLDS))
+    style_counts = ["num_baroque", "num_impressionist", "num_modern", "num_abstract"]
+
+    for time, kind, style, painting, customer, score, value in read_trace(path).tolist():
+        if kind == ARRIVAL:
+            # ids are handed out in order of arrival
+            while len(customers) <= customer:
+                customers.add(0, 0.0)
+            customers.favorite_style[customer] = style
+            customers.tolerance[customer] = value
+            customers.arrived[customer] = True
+            customers.arrival_time[customer] = time
+            stats.num_arrived += 1
+            setattr(stats, style_counts[style], getattr(stats, style_counts[style]) + 1)
+        elif kind == MOVE:
+            if customers.num_paintings_viewed[customer] > 0:
+                previous = customers.current_painting[customer]
+                paintings.set_num_viewers(previous, paintings.num_viewers[previous] - 1, time)
+            paintings.set_num_viewers(painting, paintings.num_viewers[painting] + 1, time)
+            stats.num_painting_views[painting] += 1
+            if style == customers.favorite_style[customer]:
+                customers.saw_favorite_style[customer] = True
+                stats.attractiveness_for_favourite += score
+            customers.mark_viewed(customer, painting)
+            customers.current_painting[customer] = painting
+            stats.total_viewing_time += value
+            stats.num_paintings_viewed += 1
+            customers.total_viewing_time[customer] += value
+            customers.num_paintings_viewed[customer] += 1
+            customers.add_score(customer, paintings[painting], score)
+        elif kind == DEPARTURE:
+            num_viewed = int(value)
+            if num_viewed < num_paintings:
+                stats.num_leave_early += 1
+                stats.num_customers_leave_early[num_viewed] += 1
+                stats.addLeaveEarlyScore(score)
+                stats.num_painting_left_leave_early += num_paintings - num_viewed
+            if num_viewed > 0:
+                previous = customers.current_painting[customer]
+                paintings.set_num_viewers(previous, paintings.num_viewers[previous] - 1, time)
+            stats.num_departed += 1
+            if customers.saw_favorite_style[customer]:
+                stats.num_saw_favorite_style += 1
+            customers.departure_time[customer] = time
+            customers.departed[customer] = True
+    return stats, customers, paintings
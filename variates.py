@@ -0,0 +1,95 @@
+import zlib
+import numpy as np
+
+
+## Random variates drawn in large vectorized blocks, one independent stream per purpose
+## (interarrival times, viewing times, tolerances, ...).
+## A purpose's stream only depends on the seed and the purpose's name, so e.g. the arrival
+## and viewing-time sequences stay the same when other parts of the model change how many
+## numbers they draw.
+##
+## For variance reduction a stream can also be made per customer (common random numbers:
+## customer k's j-th viewing time is the same in every scenario run from the same seed),
+## and a supply can be antithetic: every draw function gets antithetic=True and returns the
+## value driven by the mirrored uniform (1 - U) of what it would otherwise have returned.
+
+DEFAULT_BLOCK_SIZE = 4096
+CUSTOMER_BLOCK_SIZE = 64
+
+
+class VariateStream:
+    '''Hands out the values of one purpose one at a time (next) or in bulk (take),
+    refilling a block of block_size values with draw(rng, n, *args) whenever it runs out.'''
+
+    __slots__ = ("rng", "draw", "args", "block_size", "block", "pos")
+
+    def __init__(self, rng, draw, args=(), block_size: int = DEFAULT_BLOCK_SIZE):
+        self.rng = rng
+        self.draw = draw
+        self.args = args
+        self.block_size = block_size
+        self.block = []
+        self.pos = 0
+
+    def _refill(self):
+        # a list of python floats/ints is much quicker to index one at a time than an ndarray
+        self.block = self.draw(self.rng, self.block_size, *self.args).tolist()
+        self.pos = 0
+
+    def next(self):
+        if self.pos >= len(self.block):
+            self._refill()
+        value = self.block[self.pos]
+        self.pos += 1
+        return value
+
+    def redraw(self, args):
+        '''draw with args from now on, the values already drawn with the old ones are dropped'''
+        self.args = tuple(args)
+        self.block = []
+        self.pos = 0
+
+    def take(self, n: int):
+        '''the next n values as an array'''
+        values = []
+        while len(values) < n:
+            if self.pos >= len(self.block):
+                self._refill()
+            chunk = self.block[self.pos:self.pos + n - len(values)]
+            self.pos += len(chunk)
+            values.extend(chunk)
+        return np.array(values)
+
+
+class VariateSupply:
+    '''The streams of one simulation run, all derived from one seed.
+    Draw functions are called as draw(rng, n, *args, antithetic).'''
+
+    def __init__(self, seed, block_size: int = DEFAULT_BLOCK_SIZE, antithetic: bool = False):
+        if not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self.seed = seed
+        self.block_size = block_size
+        self.antithetic = antithetic
+        self.streams = {}
+
+    def substream(self, name: str, index: int = None):
+        '''SeedSequence for a purpose (and optionally one customer), keyed on the purpose's
+        name rather than on the order streams are made in'''
+        key = self.seed.spawn_key + (zlib.crc32(name.encode()),)
+        if index is not None:
+            key += (index,)
+        return np.random.SeedSequence(self.seed.entropy, spawn_key=key)
+
+    def stream(self, name: str, draw, args=()):
+        '''the VariateStream for purpose name, made on first use'''
+        if name not in self.streams:
+            self.streams[name] = VariateStream(np.random.default_rng(self.substream(name)), draw,
+                                               tuple(args) + (self.antithetic,), self.block_size)
+        return self.streams[name]
+
+    def customer_stream(self, name: str, index: int, draw, args=()):
+        '''a new VariateStream for purpose name of customer index (not kept by the supply,
+        the caller drops it when the customer leaves)'''
+        return VariateStream(np.random.default_rng(self.substream(name, index)), draw,
+                             tuple(args) + (self.antithetic,), CUSTOMER_BLOCK_SIZE)